@@ -0,0 +1,51 @@
+from hwsa.batch import read_manifest, run_batch, print_summary
+import hwsa.utils as utils
+
+
+def main(
+        manifest: str,
+        n_processes: int,
+        summary: str,
+        d: bool
+):
+    utils.set_debug(d)
+    events = read_manifest(manifest)
+    summaries = run_batch(events, n_processes=n_processes, summary_path=summary)
+    print_summary(summaries)
+    if summary is not None:
+        print(f"\nCombined summary written to {summary}")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Assigns rooms for several events together, each in its own process."
+    )
+    parser.add_argument(
+        "manifest",
+        type=str,
+        help="Path to a YAML manifest of events, each with its XLSX path, output directory, room list and "
+             "max_per_room; see hwsa.batch.read_manifest()."
+    )
+    parser.add_argument(
+        "--n_processes",
+        type=int,
+        default=None,
+        help="Number of events to run at once; defaults to the number of CPUs."
+    )
+    parser.add_argument(
+        "--summary",
+        type=str,
+        default="batch_summary.yaml",
+        help="Path to write the combined summary of all events to."
+    )
+    parser.add_argument(
+        "-d",
+        action="store_true",
+        help="Debug mode"
+    )
+
+    args = parser.parse_args()
+
+    main(**args.__dict__)
@@ -0,0 +1,100 @@
+"""
+Times the membership tests that the allocation passes lean on, with Attendee and Room identity as it is now against the
+old str()-based __eq__/__hash__.
+
+    python benchmarks/identity.py [n_attendees]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hwsa.attendee import Attendee  # noqa: E402
+from hwsa.room import Room  # noqa: E402
+
+
+class StrAttendee(Attendee):
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return str(self) == str(other)
+
+    def __hash__(self):
+        return hash(str(self))
+
+
+class StrRoom(Room):
+    __slots__ = ()
+
+    def __hash__(self):
+        return hash(str(self))
+
+
+def make_people(cls, n: int):
+    return list(map(
+        lambda i: cls(
+            id=100000 + i,
+            name_given=f"Given{i}",
+            name_family=f"Family{i % 997}",
+            gender=["Man", "Woman", "Non-binary"][i % 3],
+            diet=["None", "Vegetarian", "Vegan"][i % 3],
+        ),
+        range(n)
+    ))
+
+
+def loops(people: list, room_cls):
+    n_per_room = 2
+    rooms = list(map(lambda i: room_cls(id=i, n_max=n_per_room), range(len(people) // n_per_room + 1)))
+    roomless = people[len(people) // 2:]
+
+    def roommates():
+        # Room.add_roommate: person not in self.roommates
+        for i, person in enumerate(people):
+            person not in rooms[i // n_per_room].roommates
+
+    def nominees():
+        # Event.assign_nominated: nominee in roomless
+        for person in people[::10]:
+            person in roomless
+
+    def properties():
+        # Category breakdowns, as built one person at a time before Event.collect_properties: person not in list
+        property_dict = {}
+        for person in people:
+            if person.diet not in property_dict:
+                property_dict[person.diet] = []
+            if person not in property_dict[person.diet]:
+                property_dict[person.diet].append(person)
+
+    def rooms_dict():
+        # Event.write_rooms: rooms_dict keyed by Room
+        table = dict(map(lambda r: (r, r.id), rooms))
+        for room in rooms:
+            table[room]
+
+    for room, (a, b) in zip(rooms, zip(people[::2], people[1::2])):
+        room.roommates = [a, b]
+    return {
+        "person not in room.roommates": roommates,
+        "nominee in roomless": nominees,
+        "person not in property_dict[prop]": properties,
+        "rooms_dict[room]": rooms_dict,
+    }
+
+
+def main(n: int = 2000, repeat: int = 3):
+    old = loops(make_people(StrAttendee, n), StrRoom)
+    new = loops(make_people(Attendee, n), Room)
+    print(f"{n} attendees; best of {repeat} runs")
+    print(f"{'loop':<36}{'str() (s)':>12}{'cached (s)':>12}{'speedup':>10}")
+    for name in old:
+        t_old = min(timeit.repeat(old[name], number=1, repeat=repeat))
+        t_new = min(timeit.repeat(new[name], number=1, repeat=repeat))
+        print(f"{name:<36}{t_old:>12.4f}{t_new:>12.4f}{t_old / t_new:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:2]))
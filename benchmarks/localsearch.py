@@ -0,0 +1,108 @@
+"""
+Checks that the local search (hwsa.localsearch.improve()) lowers the score terms it targets, on synthetic registrations
+(see hwsa.synthetic):
+
+- starting from the gender and preference passes alone, which leave nominees apart, it brings people back together
+  with their nominees;
+- after the greedy passes, it evens out occupancy;
+- after the optimal allocator, it leaves the rooms packed.
+
+    python benchmarks/localsearch.py [--n 1000] [--max_per_room 2] [--iterations 100000]
+
+Exits with status 1 if any check fails.
+"""
+
+import contextlib
+import math
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hwsa.event import Event  # noqa: E402
+from hwsa.synthetic import write_mq_xl  # noqa: E402
+
+terms = ["roomless", "nominee_failed", "imbalance", "empty_rooms"]
+
+
+def allocate(path: str, n: int, output: str, start: str, max_per_room: int):
+    event = Event.from_mq_xl(
+        path,
+        output=output,
+        max_per_room=max_per_room,
+        n_rooms=math.ceil(1.05 * n / max_per_room),
+        cache=False
+    )
+    event.check_for_duplicates(show=False)
+    if start == "greedy":
+        event.assign_nominated()
+    elif start == "optimal":
+        event.assign_optimal()
+        return event
+    else:
+        # Nominees are linked, but left to fall wherever the other passes put them
+        event._find_nominated()
+    event.assign_accessible()
+    event.assign_by_gender()
+    event.assign_by_preference()
+    return event
+
+
+def run(n: int, max_per_room: int, iterations: int, seed: int = 0):
+    """
+    Allocates n synthetic registrations from each starting point, improves each allocation, and checks the result.
+    :return: list of (starting point, initial terms, final terms, list of failed checks).
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"registrations_{n}_{seed}.xlsx")
+        write_mq_xl(path, n, seed=seed)
+        for start in ("unpaired", "greedy", "optimal"):
+            output = os.path.join(tmp, start)
+            os.makedirs(output)
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                event = allocate(path, n, output=output, start=start, max_per_room=max_per_room)
+                result = event.improve_allocation(max_iterations=iterations, seed=seed, pack=start == "optimal")
+            initial, final = result["initial"], result["final"]
+            failed = []
+            if final["roomless"] > initial["roomless"]:
+                failed.append("more people roomless")
+            if start == "unpaired" and final["nominee_failed"] >= initial["nominee_failed"]:
+                failed.append("no nominees reunited")
+            if start == "greedy" and final["nominee_failed"] > initial["nominee_failed"] \
+                    and final["roomless"] == initial["roomless"]:
+                failed.append("more nominees apart")
+            if start == "greedy" and initial["imbalance"] > 0 and final["imbalance"] >= initial["imbalance"]:
+                failed.append("occupancy not evened out")
+            if start == "optimal" and final["empty_rooms"] < initial["empty_rooms"] \
+                    and final["roomless"] == initial["roomless"]:
+                failed.append("packed rooms spread out")
+            results.append((start, initial, final, failed))
+    return results
+
+
+def main(n: int, max_per_room: int, iterations: int, seed: int):
+    results = run(n, max_per_room=max_per_room, iterations=iterations, seed=seed)
+    print(f"{n} attendees, {max_per_room} per room, {iterations} moves")
+    print(f"{'start':<10}" + "".join(map(lambda t: f"{t:>24}", terms)))
+    n_failed = 0
+    for start, initial, final, failed in results:
+        line = f"{start:<10}"
+        for term in terms:
+            line += f"{initial[term]:>11.4g} -> {final[term]:<9.4g}"
+        print(line + ("  FAILED: " + "; ".join(failed) if failed else ""))
+        n_failed += len(failed)
+    return n_failed
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Checks that the local search improves what it targets.")
+    parser.add_argument("--n", type=int, default=1000, help="Number of attendees.")
+    parser.add_argument("--max_per_room", type=int, default=2, help="Room capacity.")
+    parser.add_argument("--iterations", type=int, default=100000, help="Number of moves for the search to try.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the registrations and the search.")
+    args = parser.parse_args()
+    sys.exit(1 if main(n=args.n, max_per_room=args.max_per_room, iterations=args.iterations, seed=args.seed) else 0)
@@ -0,0 +1,167 @@
+"""
+Times the main stages of a run on synthetic registrations (see hwsa.synthetic) at increasing numbers of attendees, and
+appends the results to a JSON-lines file so that they can be compared between commits.
+
+    python benchmarks/scaling.py [--sizes 100 1000 10000 100000] [--allocation greedy]
+
+Each run is compared against the last one recorded for the same size and allocation method. The default results file,
+benchmarks/results/scaling.jsonl, is not tracked by git.
+"""
+
+import contextlib
+import datetime
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hwsa.event import Event  # noqa: E402
+from hwsa.synthetic import write_mq_xl  # noqa: E402
+
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+stages = ["from_mq_xl", "check_for_duplicates", "allocate_roommates", "show_report"]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=benchmark_dir,
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(n: int, work_dir: str, allocation: str = "greedy", seed: int = 0, max_per_room: int = 2):
+    """
+    Generates n synthetic registrations and times each stage of a run on them.
+    :return: dict of results.
+    """
+    path = os.path.join(work_dir, f"registrations_{n}_{seed}.xlsx")
+    if not os.path.isfile(path):
+        write_mq_xl(path, n, seed=seed)
+    output = os.path.join(work_dir, f"output_{n}")
+    os.makedirs(output, exist_ok=True)
+
+    timings = {}
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        event = Event.from_mq_xl(
+            path,
+            output=output,
+            max_per_room=max_per_room,
+            n_rooms=math.ceil(1.05 * n / max_per_room),
+            cache=False
+        )
+        timings["from_mq_xl"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        event.check_for_duplicates()
+        timings["check_for_duplicates"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        event.allocate_roommates(method=allocation)
+        timings["allocate_roommates"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        event.show_report(plot=False)
+        timings["show_report"] = time.perf_counter() - start
+
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "n": n,
+        "n_attendees": len(event.attendees),
+        "allocation": allocation,
+        "seed": seed,
+        "timings": timings,
+        "phases": dict(map(lambda item: (item[0], item[1]["seconds"]), event.profile["phases"].items())),
+        "counters": event.profile["counters"],
+    }
+
+
+def load_results(path: str):
+    if not os.path.isfile(path):
+        return []
+    with open(path) as file:
+        return list(map(json.loads, filter(None, map(str.strip, file))))
+
+
+def main(sizes: list, allocation: str, seed: int, results_path: str, work_dir: str = None):
+    previous = load_results(results_path)
+    os.makedirs(os.path.dirname(os.path.abspath(results_path)), exist_ok=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        if work_dir is None:
+            work_dir = tmp
+        os.makedirs(work_dir, exist_ok=True)
+        print(f"{'n':>8}" + "".join(map(lambda s: f"{s:>24}", stages)))
+        for n in sizes:
+            result = run(n, work_dir=work_dir, allocation=allocation, seed=seed)
+            last = None
+            for old in previous:
+                if old["n"] == n and old["allocation"] == allocation and old["seed"] == seed:
+                    last = old
+            line = f"{n:>8}"
+            for stage in stages:
+                cell = f"{result['timings'][stage]:.3f}s"
+                if last is not None and last["timings"].get(stage):
+                    cell += f" ({result['timings'][stage] / last['timings'][stage]:.2f}x)"
+                line += f"{cell:>24}"
+            print(line)
+            with open(results_path, "a") as file:
+                file.write(json.dumps(result) + "\n")
+    print(f"Results appended to {results_path}; ratios are against the last recorded run.")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Times each stage of a run at increasing numbers of attendees.")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[100, 1000, 10000, 100000],
+        help="Numbers of attendees to run with."
+    )
+    parser.add_argument(
+        "--allocation",
+        choices=["greedy", "optimal", "multistart"],
+        default="greedy",
+        help="Roommate allocation method."
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed for the synthetic registrations."
+    )
+    parser.add_argument(
+        "--results",
+        default=os.path.join(benchmark_dir, "results", "scaling.jsonl"),
+        help="JSON-lines file to append results to."
+    )
+    parser.add_argument(
+        "--work_dir",
+        default=None,
+        help="Directory for the synthetic exports and outputs, which are kept for later runs; defaults to a temporary "
+             "directory."
+    )
+    args = parser.parse_args()
+    main(
+        sizes=args.sizes,
+        allocation=args.allocation,
+        seed=args.seed,
+        results_path=args.results,
+        work_dir=args.work_dir
+    )
@@ -0,0 +1,411 @@
+import numpy as np
+
+import hwsa.utils as u
+
+log = u.get_logger("allocation")
+
+
+def unit_type(unit: list):
+    """
+    Units (a lone person, or a group of nominees who must share a room) with the same unit type are interchangeable as
+    far as allocation is concerned.
+    :return: sorted tuple of the members' compatibility types, from Event.encode_attendee().
+    """
+    return tuple(sorted(map(lambda p: p.compatibility_type, unit)))
+
+
+def build_units(people: list, nominee_pairs: list):
+    """
+    Splits people into allocation units.
+    :param people: list of roomless Attendees.
+    :param nominee_pairs: list of lists of Attendees who should share a room; anyone not in people is ignored.
+    :return: list of units, each a list of Attendees.
+    """
+    ids = set(map(id, people))
+    units = []
+    placed = set()
+    for group in nominee_pairs:
+        group = list(filter(lambda p: id(p) in ids and id(p) not in placed, group))
+        if len(group) > 1:
+            units.append(group)
+            placed.update(map(id, group))
+    for person in people:
+        if id(person) not in placed:
+            units.append([person])
+            placed.add(id(person))
+    return units
+
+
+def split_group(group: list, max_size: int, compatible=None):
+    """
+    Splits a nominee group into pieces that can each share a room: none larger than max_size, and with everyone in a
+    piece allowed to share with each other. Members are taken in a breadth-first walk along their nominations, starting
+    from the most-linked member and following mutual nominations first, and each joins the first piece holding someone
+    they are linked to that has space and suits them, or else starts a piece of their own, so that people who nominated
+    each other mostly end up together.
+    :param group: list of Attendees, as from Event.nominee_groups().
+    :param max_size: the largest piece allowed.
+    :param compatible: function taking two Attendees and returning whether they may share a room, eg
+        hwsa.event.may_share(); if None, anyone may.
+    :return: list of pieces, each a list of Attendees; pieces of one are people who couldn't join anyone they are
+        linked to.
+    """
+    index = dict(map(lambda item: (id(item[1]), item[0]), enumerate(group)))
+    links = list(map(lambda _: set(), group))
+    nominated = list(map(lambda _: set(), group))
+    for i, person in enumerate(group):
+        j = index.get(id(person.roommate_nominee_obj))
+        if j is not None and j != i:
+            nominated[i].add(j)
+            links[i].add(j)
+            links[j].add(i)
+
+    def mutual(i, j):
+        return j in nominated[i] and i in nominated[j]
+
+    def walk_from(start):
+        walk = [start]
+        seen.add(start)
+        for i in walk:
+            for j in sorted(links[i] - seen, key=lambda k: (not mutual(i, k), k)):
+                seen.add(j)
+                walk.append(j)
+        return walk
+
+    order = []
+    seen = set()
+    for start in sorted(range(len(group)), key=lambda k: (-len(links[k]), k)):
+        if start not in seen:
+            order += walk_from(start)
+
+    pieces = []
+    for i in order:
+        def suits(piece):
+            return len(piece) < max_size and all(map(
+                lambda j: compatible is None or compatible(group[i], group[j]),
+                piece
+            ))
+        linked = list(filter(lambda piece: links[i] & set(piece) and suits(piece), pieces))
+        if linked:
+            linked[0].append(i)
+        else:
+            pieces.append([i])
+    return list(map(lambda piece: list(map(lambda i: group[i], piece)), pieces))
+
+
+def slot_classes(types: list, compatibility: np.ndarray, occupants: list = ()):
+    """
+    Groups unit types that are interchangeable when filling a room: the same size, compatible with the same unit
+    types, and able to join the same occupants. Rooms are then described by patterns of slots, each taken by a unit of
+    its slot class or of any class that fills it, ie is the same size and compatible with everyone the slot's class
+    is and can join everyone it can.
+    :param types: list of unit types.
+    :param compatibility: the compatibility matrix from Event.compatibility_matrix().
+    :param occupants: list of the unit types of the occupants of each kind of room.
+    :return: tuple of (list of the class of each unit type, list of a unit type standing for each class, and a
+        boolean array of whether units of each class fill slots of each class).
+    """
+    profiles = {}
+    classes = []
+    representatives = []
+    for t in types:
+        profile = (
+            len(t),
+            tuple(map(lambda other: bool(compatibility[np.ix_(t, other)].all()), types)),
+            tuple(map(lambda o: bool(compatibility[np.ix_(t, o)].all()), occupants))
+        )
+        if profile not in profiles:
+            profiles[profile] = len(representatives)
+            representatives.append(t)
+        classes.append(profiles[profile])
+    sizes = np.array(list(map(lambda p: p[0], profiles)))
+    allowed = np.array(list(map(lambda p: p[1] + p[2], profiles)), dtype=bool).reshape(len(profiles), -1)
+    fills = (sizes[:, np.newaxis] == sizes[np.newaxis, :]) \
+        & np.all(allowed[:, np.newaxis, :] >= allowed[np.newaxis, :, :], axis=2)
+    return classes, representatives, fills
+
+
+def enumerate_patterns(
+        types: list,
+        max_size: int,
+        compatibility: np.ndarray,
+        maximal: bool = False,
+        fills: np.ndarray = None
+):
+    """
+    Lists every way of filling a room with units whose members are all compatible with each other.
+    :param types: list of unit types.
+    :param max_size: the room capacity.
+    :param compatibility: the compatibility matrix from Event.compatibility_matrix().
+    :param maximal: If True, only list the patterns that no further unit could join; every other pattern is part of
+        one of these.
+    :param fills: boolean array of whether units of each type can take the place of each other type, as from
+        slot_classes(); if given, patterns in which a unit could be swapped for one of a type it fills are left out,
+        as the pattern with the swap can hold everything they can.
+    :return: list of patterns, each a tuple of indices into types (with repeats).
+    """
+    compatible = np.zeros((len(types), len(types)), dtype=bool)
+    for i, type_1 in enumerate(types):
+        for j, type_2 in enumerate(types):
+            compatible[i, j] = compatibility[np.ix_(type_1, type_2)].all()
+    sizes = list(map(len, types))
+
+    patterns = []
+
+    def fits(i: int, pattern: tuple, size: int):
+        return size + sizes[i] <= max_size and all(compatible[i, j] for j in pattern)
+
+    def swappable(pattern: tuple):
+        for k, i in enumerate(pattern):
+            rest = pattern[:k] + pattern[k + 1:]
+            size = sum(sizes[j] for j in rest)
+            if any(map(lambda j: j != i and fills[i, j] and fits(j, rest, size), range(len(types)))):
+                return True
+        return False
+
+    def extend(pattern: tuple, size: int, start: int):
+        if pattern and not (maximal and any(map(lambda i: fits(i, pattern, size), range(len(types))))):
+            if fills is None or not swappable(pattern):
+                patterns.append(pattern)
+        for i in range(start, len(types)):
+            if fits(i, pattern, size):
+                extend(pattern + (i,), size + sizes[i], i)
+
+    extend((), 0, 0)
+    return patterns
+
+
+def solve_patterns(
+        types: list,
+        counts: list,
+        fills: np.ndarray,
+        patterns: list,
+        n_rooms,
+        room_classes: list = None,
+        needs: list = None,
+        accessible: list = None,
+        nominee_weight: float = None,
+        time_limit: float = 30.
+):
+    """
+    Chooses how many rooms to fill with each pattern, and how many units of each type to put in the slots of each
+    class in each class of room, as an integer linear programme solved with SciPy's HiGHS interface. Rooms need not
+    fill every slot of their pattern, so only the patterns from enumerate_patterns() with maximal=True are needed. The
+    objective puts, in order of priority: housing as many people as possible; keeping nominee groups together; putting
+    people who need an accessible room in one; and using as few rooms as possible.
+    :param types: list of unit types.
+    :param counts: number of units of each type available.
+    :param fills: boolean array of whether units of each type can take slots of each slot class.
+    :param patterns: list of patterns, each a tuple of slot classes (with repeats).
+    :param n_rooms: number of rooms available; or, with room_classes, a list of the number of rooms in each class.
+    :param room_classes: for rooms of different kinds, the index into n_rooms of the class of room each pattern fills.
+    :param needs: for each unit type, the number of its members who need an accessible room.
+    :param accessible: for each class of room, whether it is accessible.
+    :param nominee_weight: weight given to each nominee group housed; defaults to just enough to outrank the lower
+        priorities.
+    :param time_limit: Time limit for the solver, in seconds.
+    :return: tuple of (numpy array of the number of rooms to fill with each pattern, numpy array of the number of units
+        of each type placed in slots of each slot class in each class of room, and whether the solver proved the
+        solution optimal). If the solver found no solution at all, nobody is placed.
+    """
+    try:
+        from scipy.optimize import milp, LinearConstraint, Bounds
+    except ImportError:
+        raise ImportError("Optimal allocation requires scipy (>= 1.9); install it or use the greedy allocator.")
+
+    if room_classes is None:
+        n_rooms = [n_rooms]
+        room_classes = [0] * len(patterns)
+    n_types, n_slots = fills.shape
+    n_classes = len(n_rooms)
+    n_patterns = len(patterns)
+    n_placed = np.zeros((n_types, n_slots, n_classes), dtype=int)
+    if not patterns or sum(n_rooms) < 1:
+        return np.zeros(n_patterns, dtype=int), n_placed, True
+
+    if needs is None:
+        needs = np.zeros(n_types)
+    if accessible is None:
+        accessible = np.zeros(n_classes, dtype=bool)
+    sizes = np.array(list(map(len, types)))
+    grouped = sizes > 1
+    n_groups = np.sum(np.array(counts)[grouped])
+    total_rooms = sum(n_rooms)
+
+    access_weight = total_rooms + 1 if (any(needs) and any(accessible)) else 0
+    if nominee_weight is None:
+        # At most as many people can be put in accessible rooms as need one, or as those rooms hold
+        slot_sizes = np.max(fills * sizes[:, np.newaxis], axis=0)
+        beds = np.zeros(n_classes)
+        for j, pattern in enumerate(patterns):
+            beds[room_classes[j]] = max(beds[room_classes[j]], sum(map(lambda c: slot_sizes[c], pattern)))
+        n_access = min(np.dot(needs, counts), np.dot(beds * np.array(n_rooms), accessible))
+        nominee_weight = access_weight * n_access + total_rooms + 1
+    # Each extra person housed must outweigh any combination of the lower priorities
+    person_weight = nominee_weight * n_groups + total_rooms + 1
+
+    # After the number of rooms of each pattern, there is a variable for the units of type t in slots of class c in
+    # rooms of class k, wherever type t can fill class c and rooms of class k have slots of class c
+    offered = set()
+    for j, pattern in enumerate(patterns):
+        offered.update(map(lambda c: (c, room_classes[j]), pattern))
+    placements = list(filter(
+        lambda v: fills[v[0], v[1]] and (v[1], v[2]) in offered,
+        ((t, c, k) for t in range(n_types) for c in range(n_slots) for k in range(n_classes))
+    ))
+    n_variables = n_patterns + len(placements)
+    weights = np.concatenate([-np.ones(n_patterns), np.array(list(map(
+        lambda v: sizes[v[0]] * person_weight + grouped[v[0]] * nominee_weight
+        + needs[v[0]] * accessible[v[2]] * access_weight,
+        placements
+    )), dtype=float)])
+
+    # Units of each type placed are at most the number available
+    supply = np.zeros((n_types, n_variables))
+    # Units placed in each slot class in each class of room are at most the slots for them in its rooms
+    capacity = np.zeros((n_slots * n_classes, n_variables))
+    for v, (t, c, k) in enumerate(placements, start=n_patterns):
+        supply[t, v] = 1
+        capacity[c * n_classes + k, v] = 1
+    for j, pattern in enumerate(patterns):
+        for c in pattern:
+            capacity[c * n_classes + room_classes[j], j] -= 1
+    # Rooms of each class filled are at most the number of rooms in it
+    rooms = np.zeros((n_classes, n_variables))
+    rooms[room_classes, np.arange(n_patterns)] = 1
+
+    upper = np.concatenate([np.full(n_patterns, total_rooms), np.array(list(map(lambda v: counts[v[0]], placements)))])
+    result = milp(
+        c=-weights,
+        constraints=[
+            LinearConstraint(supply, ub=np.array(counts)),
+            LinearConstraint(capacity, ub=0),
+            LinearConstraint(rooms, ub=np.array(n_rooms))
+        ],
+        integrality=np.ones(n_variables),
+        bounds=Bounds(0, upper),
+        options={"time_limit": time_limit}
+    )
+    if result.x is None:
+        log.warning("Optimal allocation found no solution: %s", result.message)
+        return np.zeros(n_patterns, dtype=int), n_placed, False
+    if not result.success:
+        log.warning("Optimal allocation stopped before proving its solution optimal: %s", result.message)
+    x = np.round(result.x).astype(int)
+    for v, (t, c, k) in enumerate(placements, start=n_patterns):
+        n_placed[t, c, k] = x[v]
+    return x[:n_patterns], n_placed, bool(result.success)
+
+
+def allocate_optimal(
+        rooms: list,
+        people: list,
+        nominee_pairs: list,
+        compatibility: np.ndarray,
+        time_limit: float = 30.
+):
+    """
+    Allocates people to rooms all at once, rather than one at a time as the greedy passes do.
+    Interchangeable people are counted together, and so are rooms with the same space left, accessibility and
+    occupants' compatibility types, so the size of the problem depends on the number of distinct gender/preference
+    combinations and kinds of room, and not on the number of attendees or rooms. Rooms are described by the maximal
+    patterns of slot classes (see slot_classes()) that are not made redundant by another, which keeps the number of
+    patterns to hundreds even for rooms of six or eight. Rooms of each kind are filled in the order given. Rooms that
+    already have occupants only take units compatible with all of them; nominee groups are not joined to members
+    already in a room.
+    :param rooms: list of Rooms with space to fill.
+    :param people: list of roomless Attendees.
+    :param nominee_pairs: list of lists of Attendees who should share a room.
+    :param compatibility: the compatibility matrix from Event.compatibility_matrix().
+    :param time_limit: Time limit for the solver, in seconds.
+    :return: tuple of (list of Rooms that people were placed in, and whether the allocation was proved optimal).
+    """
+    units = build_units(people=people, nominee_pairs=nominee_pairs)
+    # Units are also told apart by how many of their members need an accessible room, if there are any to put them in
+    any_accessible = any(map(lambda r: r.is_accessible(), rooms))
+    pools = {}
+    for unit in units:
+        needs = sum(map(lambda p: p.needs_accessible_room(), unit)) if any_accessible else 0
+        key = (unit_type(unit), needs)
+        if key not in pools:
+            pools[key] = []
+        pools[key].append(unit)
+    # Reversed so that units can be popped off the end in their original order
+    for pool in pools.values():
+        pool.reverse()
+    keys = list(pools.keys())
+    types = list(map(lambda k: k[0], keys))
+    counts = list(map(lambda k: len(pools[k]), keys))
+    log.debug("Optimal allocation: %s units of %s types for %s rooms.", len(units), len(types), len(rooms))
+
+    # Rooms are classed by the space left in them, accessibility and who is already in them
+    def room_class(room):
+        return room.n_max - room.n_roommates(), room.is_accessible(), unit_type(room.roommates)
+
+    classes = sorted(set(map(room_class, rooms)))
+    by_class = dict(map(lambda c: (c, []), classes))
+    for room in rooms:
+        by_class[room_class(room)].append(room)
+    occupants = sorted(set(map(lambda c: c[2], classes)))
+    slots, representatives, fills = slot_classes(types=types, compatibility=compatibility, occupants=occupants)
+    # Slot classes whose units may join each room's occupants
+    joinable = dict(map(
+        lambda o: (o, tuple(filter(
+            lambda c: compatibility[np.ix_(representatives[c], o)].all(),
+            range(len(representatives))
+        ))),
+        occupants
+    ))
+    enumerated = {}
+    patterns = []
+    room_classes = []
+    for k, (space, room_accessible, occupied) in enumerate(classes):
+        key = (space, joinable[occupied])
+        if key not in enumerated:
+            found = enumerate_patterns(
+                types=list(map(lambda c: representatives[c], key[1])),
+                max_size=space,
+                compatibility=compatibility,
+                maximal=True,
+                fills=fills[np.ix_(key[1], key[1])]
+            )
+            enumerated[key] = list(map(lambda pattern: tuple(map(lambda i: key[1][i], pattern)), found))
+        patterns += enumerated[key]
+        room_classes += [k] * len(enumerated[key])
+    log.debug(
+        "\t%s room patterns over %s slot classes for %s kinds of room.",
+        len(patterns), len(representatives), len(classes)
+    )
+    n_each, n_placed, optimal = solve_patterns(
+        types=types,
+        counts=counts,
+        fills=fills[slots],
+        patterns=patterns,
+        n_rooms=list(map(lambda c: len(by_class[c]), classes)),
+        room_classes=room_classes,
+        needs=list(map(lambda k: k[1], keys)),
+        accessible=list(map(lambda c: c[1], classes)),
+        time_limit=time_limit
+    )
+
+    assigned = []
+    # Larger patterns first, so that the fullest rooms come first
+    for j in sorted(range(len(patterns)), key=lambda k: -sum(len(representatives[c]) for c in patterns[k])):
+        k = room_classes[j]
+        for _ in range(n_each[j]):
+            room = by_class[classes[k]].pop(0)
+            filled = False
+            for c in patterns[j]:
+                # The slot is left empty once every unit the solver put in these slots has been placed
+                t = next(filter(lambda i: n_placed[i, c, k] > 0, range(len(types))), None)
+                if t is None:
+                    continue
+                n_placed[t, c, k] -= 1
+                for person in pools[keys[t]].pop():
+                    # Compatibility is guaranteed by the pattern; nominee groups are allowed through regardless, as in
+                    # Event.assign_nominated()
+                    room.add_roommate(person, override_suitable=True)
+                filled = True
+            if filled:
+                assigned.append(room)
+    return assigned, optimal
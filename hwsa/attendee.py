@@ -3,6 +3,7 @@ import os.path
 import numpy as np
 import pandas as pd
 
+from hwsa.emails import EmailTemplate, render_roommate_email
 import hwsa.utils as u
 
 # from hwsa.room import Room
@@ -28,12 +29,52 @@ affiliation_aliases = {
     "Unviversity of New South Wales": "University of New South Wales",
 }
 
+# Answers to the accessibility question that don't call for an accessible room, in lower case.
+no_accessibility_needs = {"", "no", "none", "nil", "n/a", "na", "not applicable"}
+
+
+class Attendee(u.SlotRecord):
+    # Attributes are kept in slots to save memory on large events; anything else passed in goes to self.extra.
+    fields = (
+        "id",
+        "name_given",
+        "name_family",
+        "phone",
+        "diet",
+        "gender",
+        "room_preferences",
+        "roommate_nominee",
+        "roommate_nominee_obj",
+        "will_nominate",
+        "room",
+        "registration_type",
+        "affiliation",
+        "affiliation_entered",
+        "other_affiliations",
+        "email",
+        "career_stage",
+        "research_types",
+        "research_topic",
+        "other_research_topic",
+        "amount_outstanding",
+        "amount_required",
+        "registered",
+        "accessibility",
+        "event",
+        "title",
+        "loc",
+        "name_str",
+        "gender_code",
+        "preference_mask",
+        "compatibility_type",
+    )
+    __slots__ = fields
 
-class Attendee:
     def __init__(
             self,
             **kwargs
     ):
+        self.extra = None
         self.id = None
         self.name_given = None
         self.name_family = None
@@ -53,12 +94,24 @@ class Attendee:
         self.event = None
         self.title = None
         self.loc = False
+        # Columns from the export with no default; NaN marks them as unset, as for empty cells.
+        self.other_affiliations = np.nan
+        self.research_types = np.nan
+        self.research_topic = np.nan
+        self.other_research_topic = np.nan
+        self.amount_outstanding = np.nan
+        self.amount_required = np.nan
+        self.registered = np.nan
+        # Set by Event.encode_attendee()
+        self.gender_code = None
+        self.preference_mask = None
+        self.compatibility_type = None
 
         for key, value in kwargs.items():
             if value not in (np.nan, "na"):
                 if isinstance(value, str):
                     value = value.replace("\n", "")
-                setattr(self, key, value)
+                self.set_field(key, value)
 
         if not isinstance(self.diet, str) or self.diet == "No specific requirements":
             self.diet = None
@@ -100,20 +153,26 @@ class Attendee:
     def __str__(self):
         return f"{self.id} {self.name_given} {self.name_family}"
 
+    # Attendees are identified by str(self), which is cached as name_str at the end of __init__; comparing and hashing
+    # that (Python caches string hashes) avoids rebuilding the string on every membership test.
     def __eq__(self, other):
+        if self is other:
+            return True
+        if isinstance(other, Attendee):
+            return self.name_str == other.name_str
         return str(self) == str(other)
 
     def __hash__(self):
-        return hash(str(self))
+        return hash(self.name_str)
 
     def full_name(self):
         return f"{self.name_given} {self.name_family}"
 
     def update_manual(self):
         if self.event is not None:
-            manual_path = os.path.join(self.event.output, "attendees_manual", self.filename() + ".yaml")
-            if os.path.isfile(manual_path):
-                self.__dict__.update(u.load_params(manual_path))
+            override = self.event.manual_override("attendees", self.filename())
+            if override is not None:
+                self.update_fields(override)
 
     def room_str(self):
         return f"{self} (gender {self.gender}; nominated {self.roommate_nominee}; room preferences {self.room_preferences})"
@@ -140,6 +199,9 @@ class Attendee:
     def has_nominee(self):
         return isinstance(self.roommate_nominee, str)
 
+    def needs_accessible_room(self):
+        return isinstance(self.accessibility, str) and self.accessibility.strip().lower() not in no_accessibility_needs
+
     def needs_room(self):
         return self.registration_type == "Attendance & Accommodation"
 
@@ -159,7 +221,7 @@ class Attendee:
         return len(self.room.roommates)
 
     def to_yaml(self):
-        a_dict = self.__dict__.copy()
+        a_dict = self.to_dict()
         for key, value in a_dict.items():
             if not isinstance(value, (float, int, str, list)):
                 value = str(value)
@@ -169,37 +231,12 @@ class Attendee:
     def generate_roommate_email(self, template: str, rm_line=None, no_rm_line=None, output_dir: str = None):
         if self.room is None:
             return
-        if rm_line is None:
-            rm_line = "You have been assigned a room with {rms}"
-        if no_rm_line is None:
-            no_rm_line = "You have been assigned a room to yourself (simply because of odd numbers)."
-
-        roommate_str = ""
-        n_roommates = len(self.room.roommates) - 1
-        for i, person in enumerate(self.room.roommates):
-            if person is not self:
-                name = person.full_name()
-                if i == n_roommates - 1:
-                    if n_roommates > 1:
-                        roommate_str += f"and {name}."
-                    else:
-                        roommate_str += f"{name}."
-                else:
-                    roommate_str += f"{name}, "
-        while roommate_str.endswith(" "):
-            roommate_str = roommate_str[:-1]
-        roommate_str = roommate_str[:-1] + "."
-        if not roommate_str:
-            rm_line = no_rm_line
-        else:
-            rm_line = rm_line.format(rms=roommate_str)
-
-        my_name = self.full_name()
-        if self.title is not None:
-            my_name = self.title + " " + my_name
-
-        email = template.format(name=my_name, roommate_line=rm_line)
-        email = self.email + "\n\n" + email
+        email = render_roommate_email(
+            person=self,
+            template=EmailTemplate(template),
+            rm_line=rm_line,
+            no_rm_line=no_rm_line
+        )
 
         if output_dir is None:
             output_dir = os.path.join(self.event.output, "roommate_emails")
@@ -219,6 +256,58 @@ class Attendee:
         yaml = u.load_params(path)
         return Attendee(**yaml)
 
+    @classmethod
+    def from_mq_xl_values(cls, row: tuple, columns: 'hwsa.ingest.MQColumns', event=None):
+        """
+        Equivalent to from_mq_xl_row(), but for a plain row tuple laid out as described by columns; see
+        hwsa.ingest.read_mq_xl().
+        """
+        names = columns.names
+        kwargs = {}
+        for attribute, i in columns.fields.items():
+            kwargs[attribute] = row[i]
+        extra = {}
+
+        if columns.career_other is not None and isinstance(row[columns.career_other], str):
+            career = row[columns.career_other]
+        else:
+            career = row[columns.career]
+            if columns.career_other is not None:
+                extra[names[columns.career_other]] = row[columns.career_other]
+
+        room_preferences = []
+        research_types = []
+        for i in columns.room_preferences:
+            if isinstance(row[i], str):
+                room_preferences.append(row[i])
+        for i in columns.research_types:
+            if isinstance(row[i], str):
+                research_types.append(row[i])
+        research_types.append(row[columns.research_other])
+
+        for i in columns.extra:
+            extra[names[i]] = row[i]
+        for i in columns.room_preferences + columns.research_types:
+            if not isinstance(row[i], str):
+                extra[names[i]] = row[i]
+
+        loc = columns.loc is not None and row[columns.loc] == "Y"
+
+        kwargs["phone"] = str(kwargs["phone"])
+        kwargs["amount_outstanding"] = float(kwargs["amount_outstanding"])
+        kwargs["amount_required"] = float(kwargs["amount_required"])
+        kwargs["registered"] = pd.to_datetime(kwargs["registered"])
+
+        return Attendee(
+            career_stage=career,
+            room_preferences=room_preferences,
+            research_types=research_types,
+            loc=loc,
+            event=event,
+            **kwargs,
+            **extra
+        )
+
     @classmethod
     def from_mq_xl_row(cls, row: 'pandas.core.series.Series', event=None):
         other_str = "Marketing - Academic Career stage (other)"
@@ -0,0 +1,178 @@
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import os
+import time
+import traceback
+
+import hwsa.utils as u
+
+log = u.get_logger("batch")
+
+# Settings each event in a manifest may give, with their defaults; path and output are required, and one of
+# room_numbers, n_rooms or rooms (the path of a room inventory; see hwsa.room.load_inventory()).
+event_defaults = {
+    "room_numbers": None,
+    "n_rooms": None,
+    "rooms": None,
+    "max_per_room": 2,
+    "allocation": "greedy",
+    "multistart": None,
+    "improve": None,
+    "output_format": "jsonl",
+    "yaml_tree": False,
+    "email_template": None,
+    "email_format": "files",
+    "plot": True,
+    "cache": True,
+}
+
+
+def read_manifest(path: str):
+    """
+    Reads a manifest of events to process together: a YAML file mapping each event's name to its settings, eg
+
+        hwsa_2023:
+          path: /data/hwsa/2023.xlsx
+          output: /data/hwsa/2023/
+          room_numbers: [79, 80, 81, 25, 26]
+          max_per_room: 2
+        workshop_2024:
+          path: /data/workshop/2024.xlsx
+          output: /data/workshop/2024/
+          n_rooms: 30
+
+    Any setting in event_defaults may also be given. An optional "defaults" entry gives settings shared by every event.
+    :param path: Path to the manifest.
+    :return: dict of event name to its full settings.
+    """
+    manifest = u.load_params(path)
+    if not manifest:
+        raise ValueError(f"No events found in manifest {path}.")
+    shared = manifest.pop("defaults", None) or {}
+    events = {}
+    for name, settings in manifest.items():
+        full = event_defaults.copy()
+        full.update(shared)
+        full.update(settings)
+        for key in ("path", "output"):
+            if not full.get(key):
+                raise ValueError(f"Event {name} in manifest {path} has no {key}.")
+        if full["room_numbers"] is None and full["n_rooms"] is None and full["rooms"] is None:
+            raise ValueError(f"Event {name} in manifest {path} needs room_numbers, n_rooms or rooms.")
+        events[name] = full
+    return events
+
+
+def run_event(name: str, settings: dict):
+    """
+    Runs one event of a batch from start to finish: reading its registrations, removing duplicates, allocating rooms and
+    writing its reports. Everything it would print or log goes to run.log in its output directory instead, so that events
+    run side by side don't interleave.
+    :param name: The event's name in the manifest.
+    :param settings: The event's settings, from read_manifest().
+    :return: dict summarising the run; if it failed, "error" holds the traceback.
+    """
+    from hwsa.event import Event
+    from hwsa.room import load_inventory
+
+    start = time.perf_counter()
+    summary = {"name": name, "path": settings["path"], "output": settings["output"], "error": None}
+    u.mkdir_check(settings["output"])
+    log_path = os.path.join(settings["output"], "run.log")
+    event = None
+    with open(log_path, "w") as log_file, contextlib.redirect_stdout(log_file), u.redirect_logs(log_file):
+        try:
+            event = Event.from_mq_xl(
+                path=settings["path"],
+                output=settings["output"],
+                max_per_room=settings["max_per_room"],
+                n_rooms=settings["n_rooms"],
+                room_numbers=settings["room_numbers"] or [],
+                room_inventory=load_inventory(settings["rooms"]) if settings["rooms"] else None,
+                cache=settings["cache"]
+            )
+            n_registrations = len(event.attendees)
+            possible, confirmed = event.check_for_duplicates()
+            event.allocate_roommates(
+                email_template_path=settings["email_template"],
+                method=settings["allocation"],
+                output_format=settings["output_format"],
+                yaml_tree=settings["yaml_tree"],
+                email_format=settings["email_format"],
+                multistart_kwargs=settings["multistart"],
+                improve_kwargs=settings["improve"]
+            )
+            event.show_report(plot=settings["plot"])
+            event.write_profile()
+        except Exception:
+            summary["error"] = traceback.format_exc()
+            print(summary["error"])
+
+    if event is not None and summary["error"] is None:
+        summary.update({
+            "n_registrations": n_registrations,
+            "n_attendees": len(event.attendees),
+            "n_duplicates_removed": sum(map(lambda cluster: len(cluster) - 1, confirmed)),
+            "n_possible_duplicates": sum(map(lambda cluster: len(cluster) - 1, possible)),
+            "n_rooms": len(event.rooms),
+            "n_rooms_full": len(event.rooms_full()),
+            "n_housed": len(list(filter(lambda p: p.has_room(), event.attendees))),
+            "n_roomless": len(list(filter(lambda p: not p.has_room() and p.needs_room(), event.attendees))),
+            "n_nominee_failed": len(list(filter(
+                lambda p: p.has_nominee() and p.roommate_nominee_obj not in p.roommates(),
+                event.attendees
+            ))),
+            "phases": dict(map(lambda item: (item[0], item[1]["seconds"]), event.profile["phases"].items())),
+        })
+    summary["seconds"] = time.perf_counter() - start
+    summary["log"] = log_path
+    return summary
+
+
+def _run_event(item: tuple):
+    return run_event(*item)
+
+
+def run_batch(events: dict, n_processes: int = None, summary_path: str = None):
+    """
+    Runs each event of a batch (see run_event()) in a pool of worker processes, then writes one combined summary.
+    :param events: dict of event name to settings, as from read_manifest().
+    :param n_processes: Number of worker processes; defaults to the number of CPUs, and is never more than the number
+        of events. With 1, the events are run one after another in this process.
+    :param summary_path: YAML file to write the combined summary to; if None, it is not written.
+    :return: dict of event name to the summary of its run, in manifest order.
+    """
+    if n_processes is None:
+        n_processes = os.cpu_count() or 1
+    n_processes = max(1, min(n_processes, len(events)))
+    log.info("Running %s events in %s processes", len(events), n_processes)
+
+    start = time.perf_counter()
+    if n_processes > 1:
+        with ProcessPoolExecutor(max_workers=n_processes) as executor:
+            summaries = list(executor.map(_run_event, events.items()))
+    else:
+        summaries = list(map(_run_event, events.items()))
+    summaries = dict(map(lambda s: (s["name"], s), summaries))
+
+    if summary_path is not None:
+        u.save_params(summary_path, {
+            "n_events": len(events),
+            "n_failed": len(list(filter(lambda s: s["error"] is not None, summaries.values()))),
+            "n_processes": n_processes,
+            "seconds": time.perf_counter() - start,
+            "events": summaries,
+        })
+    return summaries
+
+
+def print_summary(summaries: dict):
+    print(f"{'Event':<32}{'Attendees':>10}{'Housed':>8}{'Roomless':>10}{'Rooms full':>13}{'Seconds':>10}")
+    for name, summary in summaries.items():
+        if summary["error"] is not None:
+            print(f"{name:<32}  FAILED; see {summary['log']}")
+            continue
+        print(
+            f"{name:<32}{summary['n_attendees']:>10}{summary['n_housed']:>8}{summary['n_roomless']:>10}"
+            f"{summary['n_rooms_full']:>7} / {summary['n_rooms']:<3}{summary['seconds']:>10.1f}"
+        )
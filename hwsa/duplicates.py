@@ -0,0 +1,137 @@
+import re
+
+from hwsa.attendee import Attendee
+import hwsa.utils as u
+
+# Email and phone blocks bigger than this are placeholders shared by many people (eg an office number), not duplicates.
+max_contact_block = 50
+# Family name blocks bigger than this are split by given name, so that a common surname doesn't compare everyone with it
+# against everyone else with it.
+max_family_block = 50
+
+
+def normalise_email(email):
+    if not isinstance(email, str):
+        return None
+    email = email.strip().lower()
+    if not email:
+        return None
+    return email
+
+
+def normalise_phone(phone):
+    if not isinstance(phone, str):
+        return None
+    digits = re.sub(r"\D", "", phone)
+    # Anything shorter than this is a placeholder or a typo, and would lump unrelated people together.
+    if len(digits) < 8:
+        return None
+    return digits
+
+
+def family_tokens(name):
+    """
+    Splits a family name into its lower-case parts, breaking on hyphens as well as whitespace.
+    :param name: The family name; anything that is not a string gives no parts.
+    :return: list of parts, without repeats.
+    """
+    tokens = []
+    for token in re.split(r"[\s-]+", u.normalise_name(name)):
+        if token and token not in tokens:
+            tokens.append(token)
+    return tokens
+
+
+def given_key(person: Attendee):
+    tokens = u.name_tokens(person.name_given)
+    if not tokens:
+        return None
+    return tokens[0]
+
+
+def blocking_keys(person: Attendee):
+    """
+    Returns the keys under which a person is filed for duplicate detection; only people sharing a key get compared.
+    :param person: The attendee.
+    :return: list of (kind, value) tuples.
+    """
+    keys = []
+    email = normalise_email(person.email)
+    if email is not None:
+        keys.append(("email", email))
+    # One key for each part of a compound or hyphenated family name, so that "Jones" is compared with "Smith-Jones"
+    for token in family_tokens(person.name_family):
+        keys.append(("family", token))
+    phone = normalise_phone(person.phone)
+    if phone is not None:
+        keys.append(("phone", phone))
+    return keys
+
+
+def names_match(person_1: Attendee, person_2: Attendee):
+    return person_1.loose_match(person_2.full_name()) or person_2.loose_match(person_1.full_name())
+
+
+def find_duplicates(people: list):
+    """
+    Finds likely duplicate registrations by comparing only people who share a blocking key (email, part of the family
+    name or phone number). Email and phone blocks over max_contact_block are skipped; family name blocks over
+    max_family_block are split by the first given name, and skipped if still too big. Two people are duplicates if their
+    names loosely match; if they also share an email address, the duplicate is considered confirmed.
+    The list passed in is not modified.
+    :param people: list of Attendees to check.
+    :return: (possible, confirmed); each a list of clusters, with each cluster a list of Attendees in the order they
+        appear in people.
+    """
+    blocks = {}
+    for i, person in enumerate(people):
+        for key in blocking_keys(person):
+            if key not in blocks:
+                blocks[key] = []
+            blocks[key].append(i)
+    for key, block in list(blocks.items()):
+        kind, value = key
+        if kind in ("email", "phone") and len(block) > max_contact_block:
+            del blocks[key]
+        elif kind == "family" and len(block) > max_family_block:
+            del blocks[key]
+            for i in block:
+                given = given_key(people[i])
+                if given is not None:
+                    sub_key = ("family_given", (value, given))
+                    if sub_key not in blocks:
+                        blocks[sub_key] = []
+                    blocks[sub_key].append(i)
+    # Sub-blocks that are still too big are people with the same common name, who can't be told apart by it anyway
+    blocks = dict(filter(lambda item: item[0][0] != "family_given" or len(item[1]) <= max_family_block, blocks.items()))
+
+    # Each pair is compared in the first block the two share, rather than remembering every pair compared
+    block_order = dict(map(lambda item: (item[1], item[0]), enumerate(blocks)))
+    person_blocks = [set() for _ in people]
+    for key, block in blocks.items():
+        for i in block:
+            person_blocks[i].add(block_order[key])
+
+    possible = u.UnionFind()
+    confirmed = u.UnionFind()
+    for key, block in blocks.items():
+        order = block_order[key]
+        for n, i in enumerate(block):
+            for j in block[n + 1:]:
+                if min(person_blocks[i] & person_blocks[j]) != order:
+                    continue
+                person, other = people[i], people[j]
+                if not names_match(person, other):
+                    continue
+                email = normalise_email(person.email)
+                if email is not None and email == normalise_email(other.email):
+                    confirmed.union(i, j)
+                else:
+                    possible.union(i, j)
+
+    def clusters(union_find):
+        groups = filter(lambda g: len(g) > 1, union_find.groups())
+        groups = sorted(map(sorted, groups))
+        return list(map(lambda g: list(map(lambda i: people[i], g)), groups))
+
+    return clusters(possible), clusters(confirmed)
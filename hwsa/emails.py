@@ -0,0 +1,151 @@
+from concurrent.futures import ThreadPoolExecutor
+import email.message
+import json
+import mailbox
+import os
+import string
+
+default_rm_line = "You have been assigned a room with {rms}"
+default_no_rm_line = "You have been assigned a room to yourself (simply because of odd numbers)."
+
+# Output formats for Event.generate_roommate_emails(): a file per attendee, or all together in one JSON-lines or
+# mbox file.
+email_formats = ("files", "jsonl", "mbox")
+
+
+class EmailTemplate:
+    """
+    A str.format() template that has been parsed once, so that rendering it for each attendee is only a join.
+    Templates using anything beyond plain named fields (positional fields, attribute or index lookups, conversions or
+    format specs) are rendered with str.format() instead.
+    """
+
+    def __init__(self, template: str):
+        self.template = template
+        self.pieces = []
+        self.compiled = True
+        for literal, field, spec, conversion in string.Formatter().parse(template):
+            if literal:
+                self.pieces.append((True, literal))
+            if field is None:
+                continue
+            if not field.isidentifier() or spec or conversion:
+                self.compiled = False
+            self.pieces.append((False, field))
+
+    def render(self, **fields):
+        if not self.compiled:
+            return self.template.format(**fields)
+        return "".join(map(lambda piece: piece[1] if piece[0] else str(fields[piece[1]]), self.pieces))
+
+
+def roommate_names(names: list):
+    """
+    Joins roommates' names for the roommate line, eg "Jo Li.", "Jo Li and Sam Wu." or "Jo Li, Sam Wu, and Kim Ng."
+    :param names: list of the other roommates' full names.
+    :return: The joined names, or an empty string if there are none.
+    """
+    if not names:
+        return ""
+    if len(names) == 1:
+        return f"{names[0]}."
+    if len(names) == 2:
+        return f"{names[0]} and {names[1]}."
+    return ", ".join(names[:-1]) + f", and {names[-1]}."
+
+
+def render_roommate_email(person: 'Attendee', template: EmailTemplate, rm_line: str = None, no_rm_line: str = None):
+    """
+    Renders a person's roommate email.
+    :param person: The Attendee, who must have a room.
+    :param template: The compiled email template, with {name} and {roommate_line} fields.
+    :param rm_line: The roommate line, with an {rms} field for the roommates' names.
+    :param no_rm_line: The roommate line for someone alone in their room.
+    :return: The email, headed by the recipient's address and a blank line.
+    """
+    if rm_line is None:
+        rm_line = default_rm_line
+    if no_rm_line is None:
+        no_rm_line = default_no_rm_line
+
+    roommate_str = roommate_names(list(map(
+        lambda p: p.full_name(),
+        filter(lambda p: p is not person, person.room.roommates)
+    )))
+    if not roommate_str:
+        rm_line = no_rm_line
+    else:
+        rm_line = rm_line.format(rms=roommate_str)
+
+    my_name = person.full_name()
+    if person.title is not None:
+        my_name = person.title + " " + my_name
+
+    return person.email + "\n\n" + template.render(name=my_name, roommate_line=rm_line)
+
+
+def render_roommate_emails(people: list, template: str, rm_line: str = None, no_rm_line: str = None):
+    """
+    Renders the roommate emails of everyone with a room, compiling the template only once.
+    :param people: list of Attendees; anyone without a room is skipped.
+    :param template: The email template, with {name} and {roommate_line} fields.
+    :return: list of (Attendee, email) tuples.
+    """
+    compiled = EmailTemplate(template)
+    return list(map(
+        lambda p: (p, render_roommate_email(p, template=compiled, rm_line=rm_line, no_rm_line=no_rm_line)),
+        filter(lambda p: p.room is not None, people)
+    ))
+
+
+def _write_file(path: str, text: str):
+    with open(path, "w") as file:
+        file.write(text)
+
+
+def write_email_files(emails: list, output_dir: str, n_threads: int = 1):
+    """
+    Writes each email to its own file, named for the Attendee's filename().
+    :param emails: list of (Attendee, email) tuples, from render_roommate_emails().
+    :param n_threads: Number of threads to write the files with.
+    """
+    paths = list(map(lambda e: os.path.join(output_dir, e[0].filename()), emails))
+    texts = list(map(lambda e: e[1], emails))
+    if n_threads > 1:
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            list(executor.map(_write_file, paths, texts))
+    else:
+        list(map(_write_file, paths, texts))
+
+
+def write_email_jsonl(emails: list, path: str):
+    """
+    Writes all emails to one JSON-lines file, in one write; each line holds the recipient's address, the file name the
+    email would otherwise have and the email itself.
+    """
+    lines = map(
+        lambda e: json.dumps({"to": e[0].email, "filename": e[0].filename(), "email": e[1]}),
+        emails
+    )
+    _write_file(path, "".join(map(lambda line: line + "\n", lines)))
+
+
+def write_email_mbox(emails: list, path: str):
+    """
+    Writes all emails to one mbox file, replacing any earlier one, with each addressed to its recipient.
+    """
+    if os.path.isfile(path):
+        os.remove(path)
+    box = mailbox.mbox(path)
+    box.lock()
+    try:
+        for person, text in emails:
+            message = email.message.EmailMessage()
+            message["To"] = person.email
+            # The address heading the rendered email is carried by the To header instead.
+            message.set_content(text.split("\n\n", 1)[1])
+            box.add(message)
+        box.flush()
+    finally:
+        box.unlock()
+        box.close()
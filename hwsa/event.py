@@ -1,15 +1,58 @@
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import copy
+import functools
+import heapq
+import itertools
+import json
+import math
+import operator
 import os
+import pickle
+import random
+import time
 
 import numpy as np
 import pandas as pd
 
-import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors
-
+from hwsa.allocation import allocate_optimal, split_group
 from hwsa.attendee import Attendee
-from hwsa.room import Room
+from hwsa.duplicates import find_duplicates
+from hwsa.incremental import PreviousAllocation, diff_registrations
+import hwsa.emails as emails
+from hwsa.ingest import read_mq_xl, read_mq_xl_cached
+import hwsa.localsearch as localsearch
+import hwsa.multistart as multistart
+from hwsa.room import Room, compatible_roommates, composition_suitable_for
+import hwsa.store as store
 import hwsa.utils as u
 
+log = u.get_logger("event")
+
+# The Attendee attribute behind each category breakdown kept on Event, and the type a value must be to be counted.
+property_attributes = {
+    "diets": ("diet", str),
+    "affiliations": ("affiliation", str),
+    "accessibility": ("accessibility", str),
+    "career_stages": ("career_stage", str),
+    "genders": ("gender", object),
+}
+
+# Lengths of the substrings of attendee names indexed for Event.find_name(). A name is looked up by the longest that
+# fits in it, since longer substrings are shared by fewer people; names shorter than the first are looked up by
+# scanning.
+name_gram_lengths = (3, 6)
+
+# Methods for Event.allocate_roommates().
+allocation_methods = ("greedy", "optimal", "multistart")
+
+# Bump this whenever a change to Event, Attendee or Room would stop an older snapshot from restoring correctly, so that
+# old snapshots are refused rather than misread.
+snapshot_version = 3
+snapshot_filename = "event.snapshot"
+# Event attributes keyed by the id() of a Room or Attendee.
+_id_keyed = ("room_positions", "room_compositions", "room_free_beds", "names_token_counts")
+
 colours = [
     "cyan",
     "magenta",
@@ -29,6 +72,19 @@ colours = [
 ]
 
 
+def profiled(phase: str):
+    """
+    Decorates an Event method so that its wall time and calls are recorded under phase in Event.profile.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.timed(phase):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
 class Event:
     def __init__(self, **kwargs):
         self.output = "/home/"
@@ -37,14 +93,59 @@ class Event:
         self.min_per_room = None
         self.attendees = []
         self.attendees_dict = {}
+        self.names_exact = {}
+        self.names_tokens = {}
+        self.names_token_counts = {}
+        self.names_token_max = 0
+        # People by their set of name tokens, and the sizes of those sets, for queries that contain a whole name;
+        # rebuilt on the next lookup (None) after anyone is removed.
+        self.names_token_sets = {}
+        self.names_token_sizes = set()
+        # People by each substring of str(person) of the name_gram_lengths, for queries that are part of a name; also
+        # rebuilt after anyone is removed.
+        self.names_grams = {}
+        # Genders are encoded as small integers and room preferences as bitmasks over them; each distinct
+        # (gender, preferences) combination is a compatibility type, indexing the rows and columns of compatibility.
+        self.gender_codes = {}
+        self.compatibility_types = {}
+        self.compatibility = None
+        self.compatibility_table = None
         self.room_numbers = []
+        # list of dicts of Room fields (see hwsa.room.load_inventory()), for rooms that differ in capacity, type,
+        # accessibility or cost; if given, it overrides room_numbers, n_rooms and max_per_room.
+        self.room_inventory = None
         self.rooms = []
         self.rooms_dict = {}
+        # Number of rooms of each capacity.
+        self.room_capacities = {}
+        # Min-heap of (full, accessible, occupancy, position) for each room, where position indexes room_order, so that
+        # the least-occupied room with space comes first and accessible rooms are only used once the others are full;
+        # entries go stale when a room's occupancy changes, and are discarded lazily by next_room().
+        self.room_queue = []
+        self.room_order = []
+        self.room_positions = {}
+        # The same kind of heap for each distinct (accessible, Room.composition()), so that rooms can be looked up by
+        # their mix of occupants rather than by checking every room.
+        self.room_groups = {}
+        self.room_compositions = {}
+        # Free beds in each room and in total, so that the gender pass can tell when every room is full without
+        # checking each one.
+        self.room_free_beds = {}
+        self.n_free_beds = 0
         self.diets = {}
         self.affiliations = {}
         self.genders = {}
         self.career_stages = {}
         self.accessibility = {}
+        # The id() of each attendee, in order, when the breakdowns above were last built by collect_properties(); they
+        # are rebuilt whenever the attendees are added to, removed or reordered.
+        self.properties_collected_for = None
+        # Files from the attendees_manual and rooms_manual directories, keyed by directory and then by the filename()
+        # they apply to; each directory is loaded on first use.
+        self.manual_overrides = {}
+        # Wall time and number of calls for each phase of the run, and counts of the work done within them; see timed()
+        # and count().
+        self.profile = {"phases": {}, "counters": {}}
         for key, value in kwargs.items():
             setattr(self, key, value)
 
@@ -54,30 +155,304 @@ class Event:
         #     if str(person) not in self.attendees_dict:
         #         self.add_attendee(person)
 
+        if self.room_inventory:
+            inventory = list(self.room_inventory)
+            # Rooms with no capacity given take max_per_room, which then becomes the largest capacity
+            if self.max_per_room is None:
+                self.max_per_room = 2
+            # Rooms are filled in order wherever occupancy is tied, so the cheapest beds come first
+            inventory.sort(key=lambda entry: entry.get("cost", 0) / (entry.get("n_max", self.max_per_room) or 1))
+            self.room_numbers = list(map(lambda entry: entry["id"], inventory))
+            self.n_rooms = len(inventory)
+        else:
+            inventory = None
+
         if not self.room_numbers:
             self.room_numbers = list(range(1, self.n_rooms + 1))
 
         if self.n_rooms is None:
             self.n_rooms = len(self.room_numbers)
 
-        for n in self.room_numbers:
-            room = Room(
-                id=n,
-                n_max=self.max_per_room,
-                event=self
-            )
-
-            self.rooms.append(
-                room
-            )
-            self.rooms_dict[room] = room
+        if inventory is not None:
+            for entry in inventory:
+                room = Room(n_max=self.max_per_room, event=self)
+                room.update_fields(entry)
+                self.add_room(room)
+            self.max_per_room = max(self.room_capacities)
+        else:
+            for n in self.room_numbers:
+                room = Room(
+                    id=n,
+                    n_max=self.max_per_room,
+                    event=self
+                )
+                self.add_room(room)
 
         self.log = []
 
+    def __getstate__(self):
+        # Some indices are keyed by id(), which doesn't survive pickling; they are stored keyed by the objects instead.
+        state = self.__dict__.copy()
+        objects = dict(map(lambda r: (id(r), r), self.room_order))
+        for people in self.names_exact.values():
+            objects.update(map(lambda p: (id(p), p), people))
+        for key in _id_keyed:
+            state[key] = list(map(lambda item: (objects[item[0]], item[1]), state[key].items()))
+        state["properties_collected_for"] = None
+        return state
+
+    def __setstate__(self, state):
+        for key in _id_keyed:
+            state[key] = dict(map(lambda item: (id(item[0]), item[1]), state.get(key, ())))
+        # Snapshots from before the gram or token set indices have them rebuilt on first use
+        state.setdefault("names_grams", None)
+        state.setdefault("names_token_sets", None)
+        state.setdefault("properties_collected_for", None)
+        self.__dict__.update(state)
+        # Snapshots from before the free-bed count have it rebuilt now
+        if "n_free_beds" not in state:
+            self.n_free_beds = 0
+            for room in self.room_order:
+                self.count_free_beds(room)
+
+    def add_room(self, room: Room):
+        self.room_positions[id(room)] = len(self.room_order)
+        self.room_order.append(room)
+        self.rooms.append(room)
+        self.rooms_dict[room] = room
+        self.room_capacities[room.n_max] = self.room_capacities.get(room.n_max, 0) + 1
+        self.update_room_index(room)
+
+    def reindex_room(self, room: Room, n_max: int):
+        """
+        Brings the room indices up to date after the room's own fields (eg capacity or accessibility, from a manual
+        override) have changed, rather than its occupants.
+        :param room: The Room.
+        :param n_max: The room's capacity before the change.
+        """
+        if n_max != room.n_max:
+            self.room_capacities[n_max] -= 1
+            if not self.room_capacities[n_max]:
+                self.room_capacities.pop(n_max)
+            self.room_capacities[room.n_max] = self.room_capacities.get(room.n_max, 0) + 1
+            self.update_min_per_room()
+        self.update_room_index(room)
+
+    def room_entry(self, room: Room):
+        """
+        The room's entry in the occupancy queues; an entry in a queue that no longer matches this is out of date.
+        """
+        return room.full(), room.is_accessible(), room.n_roommates(), self.room_positions[id(room)]
+
+    def update_room_index(self, room: Room):
+        self.count_free_beds(room)
+        entry = self.room_entry(room)
+        heapq.heappush(self.room_queue, entry)
+        composition = room.composition()
+        self.room_compositions[id(room)] = composition
+        key = (room.is_accessible(), composition)
+        if key not in self.room_groups:
+            self.room_groups[key] = []
+        heapq.heappush(self.room_groups[key], entry)
+
+    def count_free_beds(self, room: Room):
+        free = max(room.n_max - room.n_roommates(), 0)
+        self.n_free_beds += free - self.room_free_beds.get(id(room), 0)
+        self.room_free_beds[id(room)] = free
+
+    def record_phase(self, phase: str, seconds: float):
+        phases = self.profile["phases"]
+        if phase not in phases:
+            phases[phase] = {"seconds": 0., "calls": 0}
+        phases[phase]["seconds"] += seconds
+        phases[phase]["calls"] += 1
+
+    @contextlib.contextmanager
+    def timed(self, phase: str):
+        """
+        Records the wall time of a block under phase in self.profile["phases"], adding to any earlier calls.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_phase(phase, time.perf_counter() - start)
+
+    def count(self, counter: str, n: int = 1):
+        counters = self.profile["counters"]
+        counters[counter] = counters.get(counter, 0) + n
+
+    def write_profile(self, path: str = None):
+        """
+        Writes self.profile to a JSON file, along with the size of the event.
+        :param path: Path to write to; defaults to output/profile.json.
+        :return: The path written to.
+        """
+        if path is None:
+            path = os.path.join(self.output, "profile.json")
+        report = {
+            "n_attendees": len(self.attendees),
+            "n_rooms": len(self.rooms),
+            "max_per_room": self.max_per_room,
+            "phases": self.profile["phases"],
+            "counters": self.profile["counters"],
+        }
+        with open(path, "w") as file:
+            json.dump(report, file, indent=2)
+        return path
+
+    def load_manual_overrides(self, kind: str, n_processes: int = 1):
+        """
+        Loads all manual overrides of one kind, replacing any loaded before.
+        :param kind: "attendees" or "rooms", for the files in output/attendees_manual or output/rooms_manual.
+        :param n_processes: Number of worker processes to parse the files in.
+        :return: dict of overrides, keyed by the filename() of the Attendee or Room each applies to.
+        """
+        self.manual_overrides[kind] = u.load_params_dir(
+            os.path.join(self.output, f"{kind}_manual"),
+            n_processes=n_processes
+        )
+        return self.manual_overrides[kind]
+
+    def manual_override(self, kind: str, filename: str):
+        """
+        Looks up the manual override for an Attendee or Room, without touching the filesystem once its directory has
+        been loaded.
+        :param kind: "attendees" or "rooms".
+        :param filename: The filename() of the Attendee or Room.
+        :return: A copy of the override's contents (which the caller may modify), or None if there is none.
+        """
+        if kind not in self.manual_overrides:
+            self.load_manual_overrides(kind)
+        override = self.manual_overrides[kind].get(filename)
+        if override is None:
+            return None
+        return copy.deepcopy(override)
+
     def add_attendee(self, person: Attendee):
         self.attendees.append(person)
         self.attendees_dict[str(person)] = person
-        self.min_per_room = int(np.ceil(len(self.attendees) / self.n_rooms))
+        self._index_name(person)
+        self.encode_attendee(person)
+        self.update_min_per_room()
+
+    def update_min_per_room(self):
+        """
+        Sets min_per_room, the occupancy that the first gender pass fills rooms to: the lowest at which filling every
+        room to it (or to capacity, if smaller) would house everyone. With rooms all the same size, this is the number
+        of attendees divided by the number of rooms, rounded up.
+        """
+        n = len(self.attendees)
+        if len(self.room_capacities) <= 1:
+            self.min_per_room = int(np.ceil(n / self.n_rooms))
+            return
+        largest = max(self.room_capacities)
+        self.min_per_room = largest
+        for level in range(1, largest + 1):
+            if sum(map(lambda item: item[1] * min(level, item[0]), self.room_capacities.items())) >= n:
+                self.min_per_room = level
+                break
+
+    def remove_attendees(self, people: list):
+        ids = set(map(id, people))
+        self.attendees[:] = list(filter(lambda p: id(p) not in ids, self.attendees))
+        for person in people:
+            if self.attendees_dict.get(str(person)) is person:
+                self.attendees_dict.pop(str(person))
+            self._unindex_name(person)
+        self.names_token_sets = None
+        self.names_grams = None
+
+    def _index_name(self, person: Attendee):
+        key = u.normalise_name(person.name_given, person.name_family)
+        if key not in self.names_exact:
+            self.names_exact[key] = []
+        self.names_exact[key].append(person)
+        tokens = _name_token_set(person)
+        self.names_token_counts[id(person)] = len(tokens)
+        for token in tokens:
+            if token not in self.names_tokens:
+                self.names_tokens[token] = []
+            self.names_tokens[token].append(person)
+            self.names_token_max = max(self.names_token_max, len(token))
+        if self.names_token_sets is not None:
+            self._index_name_token_set(person)
+        if self.names_grams is not None:
+            self._index_name_grams(person)
+
+    def _index_name_token_set(self, person: Attendee):
+        tokens = frozenset(_name_token_set(person))
+        if not tokens:
+            return
+        if tokens not in self.names_token_sets:
+            self.names_token_sets[tokens] = []
+        self.names_token_sets[tokens].append(person)
+        self.names_token_sizes.add(len(tokens))
+
+    def _index_name_grams(self, person: Attendee):
+        name = str(person)
+        for length in name_gram_lengths:
+            for gram in set(_name_grams(name, length)):
+                if gram not in self.names_grams:
+                    self.names_grams[gram] = []
+                self.names_grams[gram].append(person)
+
+    def _unindex_name(self, person: Attendee):
+        key = u.normalise_name(person.name_given, person.name_family)
+        if key in self.names_exact:
+            self.names_exact[key] = list(filter(lambda p: p is not person, self.names_exact[key]))
+        self.names_token_counts.pop(id(person), None)
+        for token in _name_token_set(person):
+            if token in self.names_tokens:
+                self.names_tokens[token] = list(filter(lambda p: p is not person, self.names_tokens[token]))
+
+    def gender_code(self, gender):
+        # Anything that isn't a string (None, nan) counts as a single unknown gender
+        if not isinstance(gender, str):
+            gender = None
+        if gender not in self.gender_codes:
+            self.gender_codes[gender] = len(self.gender_codes)
+        return self.gender_codes[gender]
+
+    def encode_attendee(self, person: Attendee):
+        person.gender_code = self.gender_code(person.gender)
+        if person.room_preferences:
+            mask = 0
+            for gender in person.room_preferences:
+                mask |= 1 << self.gender_code(gender)
+        else:
+            # No preferences means comfortable with everyone; -1 has every bit set
+            mask = -1
+        person.preference_mask = mask
+        key = (person.gender_code, mask)
+        if key not in self.compatibility_types:
+            self.compatibility_types[key] = len(self.compatibility_types)
+            self.compatibility = None
+        person.compatibility_type = self.compatibility_types[key]
+
+    def compatibility_matrix(self):
+        """
+        Returns the boolean compatibility matrix between compatibility types, building it if any new types have
+        appeared since it was last built.
+        :return: numpy array; element [i, j] is True if a person of type i and a (different) person of type j are
+            compatible roommates.
+        """
+        if self.compatibility is None:
+            keys = list(self.compatibility_types)
+            genders = np.array(list(map(lambda k: k[0], keys)), dtype=np.int64)
+            masks = np.array(list(map(lambda k: k[1], keys)), dtype=np.int64)
+            # prefers[i, j] is 1 if type i is comfortable sharing with the gender of type j
+            prefers = (masks[:, np.newaxis] >> genders[np.newaxis, :]) & 1
+            self.compatibility = (prefers & prefers.T).astype(bool)
+            self.compatibility_table = self.compatibility.tolist()
+        return self.compatibility
+
+    def compatibility_lookup(self):
+        """
+        The compatibility matrix as nested lists, which are quicker than numpy for looking up single elements.
+        """
+        self.compatibility_matrix()
+        return self.compatibility_table
 
     def print_attendees(self, people: list = None, sort: bool = False):
         if people is None:
@@ -88,17 +463,82 @@ class Event:
         for person in people:
             print(f"\t{person}, {person.room}, Needs room: {person.needs_room()}", )
 
-    def find_name(self, name: str):
+    def find_name(self, name: str, positions: dict = None):
+        """
+        Finds the first attendee (in the order of the attendee list) that Attendee.loose_match() accepts for the name:
+        either the name is part of str(person), or the person's family and given names are both part of the name.
+        Candidates for each come from the name indices, so the attendee list is only scanned for names shorter than
+        the first of name_gram_lengths.
+        :param name: The name to look up, eg a roommate nominee.
+        :param positions: dict of id(Attendee) to its index in the attendee list, to save working it out when looking up
+            many names at once; see _find_nominated().
+        :return: The Attendee, or None if nobody matches.
+        """
         if "(" in name and ")" in name:
             in_brackets = name[name.find("("):name.find(")") + 1]
             name.replace(in_brackets, "")
         while name.endswith(" "):
             name = name[:-1]
 
-        for person in self.attendees:
-            if person.loose_match(name):
-                return person
-        return None
+        if len(name) < name_gram_lengths[0]:
+            for person in self.attendees:
+                if person.loose_match(name):
+                    return person
+            return None
+
+        # People whose names are part of the query: their family and given names must appear somewhere in it, so only
+        # people with every one of their name tokens inside the query are candidates. Checking every substring
+        # against the token index is quadratic in the length of the query, but independent of the number of attendees.
+        query = name.lower()
+        tokens = set()
+        for start in range(len(query)):
+            for end in range(start + 1, min(len(query), start + self.names_token_max) + 1):
+                if query[start:end] in self.names_tokens:
+                    tokens.add(query[start:end])
+        candidates = {}
+        for person in self.names_exact.get(u.normalise_name(name), []):
+            candidates[id(person)] = person
+        if self.names_token_sets is None:
+            self.names_token_sets = {}
+            self.names_token_sizes = set()
+            for person in self.attendees:
+                self._index_name_token_set(person)
+        # Each combination of the tokens found is looked up as a whole set of name tokens, unless there are so many
+        # combinations that counting each person's tokens over the token index is quicker
+        n_combinations = sum(map(lambda size: math.comb(len(tokens), size), self.names_token_sizes))
+        if n_combinations <= sum(map(lambda token: len(self.names_tokens[token]), tokens)):
+            for size in self.names_token_sizes:
+                for combination in itertools.combinations(tokens, size):
+                    for person in self.names_token_sets.get(frozenset(combination), []):
+                        candidates[id(person)] = person
+        else:
+            hits = {}
+            for token in tokens:
+                for person in self.names_tokens[token]:
+                    hits[id(person)] = hits.get(id(person), 0) + 1
+            for token in tokens:
+                for person in self.names_tokens[token]:
+                    if hits.pop(id(person), 0) == self.names_token_counts[id(person)]:
+                        candidates[id(person)] = person
+
+        # People whose names contain the query: they contain each of its grams, so the rarest gram's people are
+        # candidates
+        if self.names_grams is None:
+            self.names_grams = {}
+            for person in self.attendees:
+                self._index_name_grams(person)
+        length = max(filter(lambda n: n <= len(name), name_gram_lengths))
+        rarest = min(map(lambda gram: self.names_grams.get(gram, []), _name_grams(name, length)), key=len)
+        for person in rarest:
+            candidates[id(person)] = person
+
+        matches = list(filter(lambda p: p.loose_match(name), candidates.values()))
+        if len(matches) <= 1:
+            return matches[0] if matches else None
+        self.count("names_tied", len(matches))
+        if positions is None:
+            positions = dict(map(lambda item: (id(item[1]), item[0]), enumerate(self.attendees)))
+        return min(matches, key=lambda p: positions[id(p)])
 
     # def _generate_pairs(self):
     #     pairs = []
@@ -113,21 +553,64 @@ class Event:
 
     def _find_nominated(self):
         with_nominees = []
-        u.debug_print("All with successfully nominated roommates:")
+        positions = dict(map(lambda item: (id(item[1]), item[0]), enumerate(self.attendees)))
+        log.debug("All with successfully nominated roommates:")
         for person in self.attendees:
             if person.has_nominee():
-                person.roommate_nominee_obj = self.find_name(person.roommate_nominee)
+                person.roommate_nominee_obj = self.find_name(person.roommate_nominee, positions=positions)
                 if person.roommate_nominee_obj is not None:
                     with_nominees.append(person)
-                    u.debug_print(f"\t{person.room_str()}")
+                    log.debug("\t%s", u.Lazy(person.room_str))
         print()
         return with_nominees
 
-    def next_room(self, rooms: list = None):
-        if rooms is None:
-            rooms = self.rooms.copy()
-        rooms.sort(key=lambda rm: rm.n_roommates())
-        return rooms.pop(0)
+    def next_room(self):
+        """
+        Returns the least-occupied room, with ties going to the room that comes first. From the occupancy queue, rooms
+        with space come before full ones, and accessible rooms only once every other room is full.
+        :return: The Room.
+        """
+        scanned = 0
+        while True:
+            scanned += 1
+            entry = self.room_queue[0]
+            room = self.room_order[entry[3]]
+            if entry == self.room_entry(room):
+                self.count("rooms_scanned", scanned)
+                return room
+            heapq.heappop(self.room_queue)
+
+    def next_room_matching(self, condition, accessible: bool = None):
+        """
+        Returns the least-occupied room with space whose composition satisfies the condition, with ties going to the
+        room that comes first. Accessible rooms only come after every other matching room is full. If no matching room
+        has space, the least-occupied full one is returned.
+        :param condition: function taking a Room.composition() tuple and returning a bool.
+        :param accessible: if True, only accessible rooms are considered.
+        :return: The Room, or None if no room matches.
+        """
+        best = None
+        scanned = 0
+        self.count("compositions_checked", len(self.room_groups))
+        for key in list(self.room_groups):
+            queue = self.room_groups[key]
+            room_accessible, composition = key
+            if (accessible and not room_accessible) or not condition(composition):
+                continue
+            while queue:
+                scanned += 1
+                room = self.room_order[queue[0][3]]
+                if queue[0] == self.room_entry(room) and self.room_compositions[id(room)] == composition:
+                    break
+                heapq.heappop(queue)
+            if not queue:
+                self.room_groups.pop(key)
+            elif best is None or queue[0] < best:
+                best = queue[0]
+        self.count("rooms_scanned", scanned)
+        if best is None:
+            return None
+        return self.room_order[best[3]]
 
     def rooms_full(self):
         return list(
@@ -146,8 +629,7 @@ class Event:
         )
 
     def all_rooms_full(self):
-        full = self.rooms_full()
-        return len(full) >= self.n_rooms
+        return self.n_free_beds <= 0
 
     def get_roomless(self, people: list = None):
         if people is None:
@@ -160,130 +642,408 @@ class Event:
             )
         )
 
-    def assign_nominated(self):
-        # Use string nominee to assign Attendee object
-        rooms = []
-        people = self._find_nominated()
-        print(f"\n{len(people)} attendees have nominated a roommate.")
-        roomless = self.get_roomless(people)
-        while roomless:
-            person = roomless.pop(0)
-            u.debug_print(f"{person.room_str()}: finding room...")
-            u.debug_print(f"\tChecking if they have a room:")
-            if person.has_room():
-                room = person.room
-                u.debug_print("\t\tTrue,", str(room))
-            else:
-                room = self.next_room()
-                u.debug_print("\t\tFalse, getting next:", str(room))
+    def nominee_groups(self, people: list = None):
+        """
+        Clusters people into nominee groups: everyone linked by roommate nominations, in either direction and through
+        chains (A nominating B, who nominates C) or several people nominating the same person, found with a union-find
+        over roommate_nominee_obj. Only the nominations of people who need a room are followed, though (as the nominated
+        pass always has) their nominees are grouped with them either way. Nominees must already have been linked (see
+        _find_nominated()).
+        :param people: Attendees whose nominations to follow; defaults to all attendees.
+        :return: list of groups of two or more, each a list of Attendees; groups come in the order of their first
+            member in people, and members in the order they were reached.
+        """
+        if people is None:
+            people = self.attendees
+        members = []
+        index = {}
+        links = u.UnionFind()
+        for person in filter(lambda p: p.has_nominee() and p.needs_room(), people):
             nominee = person.roommate_nominee_obj
-            u.debug_print(f"\tFound nominated:", nominee.room_str())
-            # Check if enough roommates have already been assigned to the person's room,
-            # and if they have nominated each other
-            u.debug_print(f"\tChecking if they have nominated eath other:", nominees_match(person, nominee))
-            u.debug_print(f"\tChecking if person's room is full:", room.full())
-            if not room.full() and nominees_match(person, nominee):
+            if not isinstance(nominee, Attendee) or nominee is person:
+                continue
+            for member in (person, nominee):
+                if id(member) not in index:
+                    index[id(member)] = len(members)
+                    members.append(member)
+            links.union(index[id(person)], index[id(nominee)])
+        groups = list(map(lambda group: list(map(lambda i: members[i], group)), links.groups()))
+        self.count("nominee_groups", len(groups))
+        return groups
+
+    def place_nominee_group(self, group: list):
+        """
+        Places a nominee group (from nominee_groups()) a piece at once: the group is split with
+        hwsa.allocation.split_group() into pieces that fit the largest room and whose members may all share (see
+        may_share()), and the roomless members of each piece go into the room of a member of the piece who already has
+        one, if it has space for them and its occupants may share with them, or else the least-occupied room that
+        suits them all (see next_room_for()). Anyone already in a room is left there, and anyone split off on their own,
+        or in a piece that no room suits, is left roomless for the later passes.
+        :param group: list of Attendees.
+        :return: list of Rooms that people were placed in.
+        """
+        rooms = []
+        for piece in split_group(group, self.max_per_room, compatible=may_share):
+            roomless = list(filter(lambda p: not p.has_room(), piece))
+            # Anyone left on their own is placed by the later passes
+            if not roomless or len(piece) < 2:
+                continue
+            room = None
+            for member in filter(lambda p: p.has_room(), piece):
+                if member.room.n_max - member.room.n_roommates() >= len(roomless) and all(map(
+                        lambda o: all(map(lambda p: may_share(p, o), roomless)),
+                        member.room.roommates
+                )):
+                    room = member.room
+                    break
+            if room is None:
+                room = self.next_room_for(roomless)
+            if room is None:
+                log.debug("No room has space for %s", u.Lazy(lambda: list(map(str, roomless))))
+                continue
+            log.debug("Placing %s in %s", u.Lazy(lambda: list(map(str, roomless))), room)
+            for person in roomless:
                 room.add_roommate(person, override_suitable=True)
-                room.add_roommate(nominee, override_suitable=True)
             if room not in rooms:
                 rooms.append(room)
-            if nominee in roomless:
-                roomless.remove(nominee)
         return rooms
 
-    def add_gender(self, person: Attendee):
-        if person.gender not in self.genders:
-            self.genders[person.gender] = []
-        if person not in self.genders[person.gender]:
-            self.genders[person.gender].append(person)
+    @profiled("assign_nominated")
+    def assign_nominated(self, rng: random.Random = None):
+        """
+        Places each nominee group (see nominee_groups()) in a room of its own, or split over as few rooms as will hold
+        it and suit its members; see place_nominee_group().
+        :param rng: If given, shuffles the order groups are placed in (see assign_multistart()), not who is grouped with
+            whom.
+        :return: list of Rooms that people were placed in.
+        """
+        # Use string nominee to assign Attendee object
+        people = self._find_nominated()
+        if rng is not None:
+            rng.shuffle(people)
+        print(f"\n{len(people)} attendees have nominated a roommate.")
+        # Groups with people of fewer preferences first, as for the other passes
+        people.sort(key=lambda a: a.n_preferences())
+        rooms = []
+        for group in self.nominee_groups(people):
+            for room in self.place_nominee_group(group):
+                if room not in rooms:
+                    rooms.append(room)
+        return rooms
 
-    def get_genders(self):
-        for p in self.attendees:
-            self.add_gender(p)
-        return self.genders
+    def next_room_for(self, people: list):
+        """
+        Returns the least-occupied room with space for all the people and whose occupants suit them all (as
+        next_room()), preferring accessible rooms if any of them need one.
+        :param people: list of Attendees to be placed together.
+        :return: The Room, or None if no room has space for them all.
+        """
+        n = len(people)
+        accessible = any(map(lambda p: p.needs_accessible_room(), people))
+
+        def fits(room):
+            return room is not None and room.n_max - room.n_roommates() >= n and all(map(room.suitable_for, people))
+
+        if accessible:
+            room = self.next_room_matching(
+                lambda c: all(map(lambda p: composition_suitable_for(c, p), people)),
+                accessible=True
+            )
+            if fits(room):
+                return room
+        room = self.next_room()
+        if fits(room):
+            return room
+        if room.n_max - room.n_roommates() < n and len(self.room_capacities) <= 1 and not accessible:
+            # With rooms all the same size, the least-occupied room has the most space
+            return None
+        self.count("rooms_scanned", len(self.room_order))
+        return min(
+            filter(fits, self.room_order),
+            key=lambda r: (r.is_accessible() != accessible, r.n_roommates(), self.room_positions[id(r)]),
+            default=None
+        )
 
-    def assign_to_room(self, room, people: list, make_copy: bool = False):
-        if make_copy:
-            people = people.copy()
-        people.sort(key=lambda a: a.n_preferences(), reverse=True)
-        while people and room.n_roommates() < self.min_per_room:
-            room.add_roommate(people.pop())
+    @profiled("assign_accessible")
+    def assign_accessible(self):
+        """
+        Puts roomless people who need an accessible room in the least-occupied accessible room that suits them, before
+        the gender and preference passes fill the other rooms.
+        :return: list of Rooms that people were placed in.
+        """
+        rooms = []
+        if not any(map(lambda r: r.is_accessible(), self.rooms)):
+            return rooms
+        for person in filter(lambda p: p.needs_accessible_room(), self.get_roomless()):
+            room = self._assign_by_condition(
+                person,
+                lambda c: composition_suitable_for(c, person),
+                accessible=True
+            )
+            if room is not None and room not in rooms:
+                rooms.append(room)
+        return rooms
 
+    def get_genders(self):
+        return self.collect_properties()["genders"]
+
+    def assign_to_room(self, room, stacks: dict):
+        """
+        Fills the room up to min_per_room from stacks, taking at each step the first person, in the order the stacks
+        were built from, that the room suits. Anyone who has been given a room since is dropped, and anyone refused by
+        the room is put back for the next one.
+        :param room: The Room.
+        :param stacks: dict from stack_by_type(), which is popped from.
+        """
+        refused = []
+        while room.n_roommates() < min(self.min_per_room, room.n_max):
+            composition = self.room_compositions[id(room)]
+            best = None
+            for stack in stacks.values():
+                while stack and stack[-1][1].has_room():
+                    stack.pop()
+                # Everyone on a stack has the same gender and preferences, so one check covers all of them
+                if stack and (best is None or stack[-1][0] > best[-1][0]) \
+                        and composition_suitable_for(composition, stack[-1][1]):
+                    best = stack
+            if best is None:
+                break
+            position, person = best.pop()
+            room.add_roommate(person)
+            if not person.has_room():
+                refused.append((best, (position, person)))
+        for stack, entry in reversed(refused):
+            stack.append(entry)
+
+    @staticmethod
+    def stack_by_type(people: list):
+        """
+        Splits people into a stack per compatibility type for assign_to_room(), so that a room only looks at the people
+        it could take rather than rescanning everyone it can't.
+        :param people: list of Attendees, in the reverse of the order they should be placed in.
+        :return: dict of compatibility type to a list of (position in people, Attendee), with the first to be placed
+            last.
+        """
+        stacks = {}
+        for position, person in enumerate(people):
+            if person.compatibility_type not in stacks:
+                stacks[person.compatibility_type] = []
+            stacks[person.compatibility_type].append((position, person))
+        return stacks
+
+    @profiled("assign_by_gender")
     def assign_by_gender(self):
         self.get_genders()
         # First put the minimum people in empty rooms
         rooms = []
-        u.debug_print("\nAssigning minimum number of people to empty rooms:")
+        log.debug("\nAssigning minimum number of people to empty rooms:")
 
         # The hullabaloo below is to alternate genders so that rooms get assigned fairly evenly between them
         roomless = self.get_roomless()
         i = 0
         gender_keys = tuple(self.genders.keys())
+        # The roomless people of each gender, split by stack_by_type() for assign_to_room(); built on the gender's first
+        # turn, with those with the fewest preferences to go first
+        queues = {}
+        placed = set()
         while roomless and not self.all_rooms_full() and i < self.n_rooms:
             n = i % len(self.genders)
             gender = gender_keys[n]
-            people_gender = self.get_roomless(self.genders[gender])
+            if gender not in queues:
+                people = self.get_roomless(self.genders[gender])
+                people.sort(key=lambda a: a.n_preferences(), reverse=True)
+                queues[gender] = self.stack_by_type(people)
             room = self.next_room()
-            # The function below also pops the person from the list, regardless of whether the allocation is successful.
-            self.assign_to_room(room=room, people=people_gender)
-            # roomless = self.get_roomless(people)
-            if room not in rooms:
+            self.assign_to_room(room=room, stacks=queues[gender])
+            if id(room) not in placed:
+                placed.add(id(room))
                 rooms.append(room)
             i += 1
-        u.debug_print("\nAssigning remaining people to gender-matching rooms:")
+        log.debug("\nAssigning remaining people to gender-matching rooms:")
         # Then, if there are still people roomless, assign them to rooms matching their gender
-        roomless = self.get_roomless()
+        # As the rooms are matched on their occupants' gender, people with none given are left to the preference pass
+        roomless = filter(lambda p: isinstance(p.gender, str), self.get_roomless())
         for person in roomless:
             room = self._assign_by_condition(
                 person,
-                lambda r: r.single_gender() == person.gender
+                lambda c: c[0] == 1 << person.gender_code
             )
-            if room not in rooms:
+            if room is not None and room not in rooms:
                 rooms.append(room)
         return rooms
 
+    @profiled("assign_by_preference")
     def assign_by_preference(self):
         roomless = self.get_roomless()
         rooms = []
         for person in roomless:
             room = self._assign_by_condition(
                 person,
-                lambda r: r.suitable_for(person)
+                lambda c: composition_suitable_for(c, person)
             )
-            if room not in rooms:
+            if room is not None and room not in rooms:
                 rooms.append(room)
         return rooms
 
-    def _assign_by_condition(self, person, condition):
-        attempts = 0
-        rooms_this = self.rooms.copy()
-        rooms_this = list(filter(condition, rooms_this))
-        while not person.has_room() and rooms_this:
-            room = self.next_room(rooms_this)
-            u.debug_print(f"Searching for rooms for {person.room_str()}")
-            u.debug_print("\t Rooms matching gender:", list((map(lambda r: r.id, rooms_this))))
-            room.add_roommate(person)
+    def _assign_by_condition(self, person, condition, accessible: bool = None):
+        """
+        Tries to put the person in the least-occupied room matching the condition.
+        :param person: The Attendee.
+        :param condition: function taking a Room.composition() tuple and returning a bool.
+        :param accessible: if True, only accessible rooms are tried.
+        :return: The Room tried, or None if the person already has a room or no room matches.
+        """
+        if person.has_room():
+            return None
+        log.debug("Searching for rooms for %s", u.Lazy(person.room_str))
+        room = self.next_room_matching(condition, accessible=accessible)
+        if room is None:
+            log.debug("Failed to find room for %s", u.Lazy(person.room_str))
+            return None
+        log.debug("\t Least-occupied matching room: %s", room.id)
+        room.add_roommate(person)
+        return room
+
+    @profiled("assign_optimal")
+    def assign_optimal(self, time_limit: float = 30.):
+        """
+        Assigns all roomless people at once to the rooms with space, including the spare beds in rooms already partly
+        filled (eg from rooms_manual), using hwsa.allocation.allocate_optimal(). Nominee groups (see nominee_groups())
+        are kept together, in the pieces from hwsa.allocation.split_group(); as in assign_nominated(), a nominee who
+        hasn't asked for accommodation is still housed with the people who nominated them, but anyone else who hasn't
+        is not housed. Unlike assign_nominated(), nobody is put in the room of a group member who already has one.
+        If the solver stops before proving its allocation optimal, the greedy passes are run on a copy of the event,
+        and their allocation is used instead if it leaves fewer people roomless, or as many and fewer without their
+        nominee.
+        :param time_limit: Time limit for the solver, in seconds.
+        :return: list of Rooms that people were placed in.
+        """
+        people = self.get_roomless()
+        nominee_pairs = []
+        for group in self.nominee_groups(self._find_nominated()):
+            for piece in split_group(group, self.max_per_room, compatible=may_share):
+                roomless = list(filter(lambda p: not p.has_room(), piece))
+                if len(roomless) > 1:
+                    people += list(filter(lambda p: not p.needs_room(), roomless))
+                    nominee_pairs.append(roomless)
+        rooms, optimal = allocate_optimal(
+            rooms=list(filter(lambda r: not r.full(), self.rooms)),
+            people=people,
+            nominee_pairs=nominee_pairs,
+            compatibility=self.compatibility_matrix(),
+            time_limit=time_limit
+        )
+        if optimal:
+            return rooms
+
+        placed = list(filter(lambda p: p.has_room(), people))
+        placed_rooms = list(map(lambda p: p.room, placed))
+        terms = multistart.score_allocation(self)
+        for person, room in zip(placed, placed_rooms):
+            room.remove_roommate(person)
+        greedy, occupants, positions = multistart.run_start(pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL), 0)
+        self.count("optimal_fallbacks")
+        if (greedy["roomless"] + greedy["overfull"], greedy["nominee_failed"]) < \
+                (terms["roomless"] + terms["overfull"], terms["nominee_failed"]):
+            log.warning(
+                "Using the greedy allocation (%s roomless, %s without their nominee) over the solver's (%s roomless, "
+                "%s without their nominee).",
+                greedy["roomless"], greedy["nominee_failed"], terms["roomless"], terms["nominee_failed"]
+            )
+            return self.apply_allocation(occupants, positions)
+        log.warning(
+            "Keeping the solver's allocation (%s roomless, %s without their nominee) over the greedy one (%s roomless, "
+            "%s without their nominee).",
+            terms["roomless"], terms["nominee_failed"], greedy["roomless"], greedy["nominee_failed"]
+        )
+        for person, room in zip(placed, placed_rooms):
+            room.add_roommate(person, override_suitable=True)
+        return rooms
 
-            attempts += 1
-            if not rooms_this:
-                u.debug_print(f"Failed to find room for {person.room_str()}")
-            return room
+    def apply_allocation(self, occupants: list, positions: list):
+        """
+        Puts people in the rooms given by an allocation worked out on a copy of the event, as returned by
+        hwsa.multistart.run_start().
+        :param occupants: list of the attendee indices in each room, in room_order.
+        :param positions: list of the room_order position of each attendee's room, or None.
+        :return: list of Rooms that have anyone in them.
+        """
+        rooms = []
+        for room, indices in zip(self.room_order, occupants):
+            for i in indices:
+                room.add_roommate(self.attendees[i], override_suitable=True)
+            if indices and room not in rooms:
+                rooms.append(room)
+        # Follow the allocation for anyone it put in more than one room
+        for person, position in zip(self.attendees, positions):
+            person.room = self.room_order[position] if position is not None else None
+        return rooms
 
-    def allocate_roommates(
+    @profiled("assign_multistart")
+    def assign_multistart(
             self,
-            email_template_path: str = None
+            n_starts: int = 32,
+            seed: int = 0,
+            time_budget: float = None,
+            n_processes: int = 1
     ):
-        # Zeroth pass: ingest rooms that have been assigned manually
-        for room in self.rooms:
-            room.update_manual()
+        """
+        Runs the greedy passes (assign_nominated(), assign_accessible(), assign_by_gender() and
+        assign_by_preference()) on many copies of the event with the attendees in different random orders, and applies
+        the allocation that scores best by hwsa.multistart.score_allocation(). See hwsa.multistart.search().
+        :param n_starts: Maximum number of variants to try; the first keeps the existing order.
+        :param seed: Seed for the variants; the same seed and n_starts always give the same allocation.
+        :param time_budget: Wall time in seconds after which no more variants are begun.
+        :param n_processes: Number of worker processes to run the variants in.
+        :return: tuple of (list of Rooms that people were placed in, dict of the search result from
+            hwsa.multistart.search()).
+        """
+        # Link nominees here as well as in each variant, for the report
+        self._find_nominated()
+        best = multistart.search(
+            self,
+            n_starts=n_starts,
+            seed=seed,
+            time_budget=time_budget,
+            n_processes=n_processes
+        )
+        self.count("multistart_starts", best["starts"])
+        return self.apply_allocation(best["occupants"], best["rooms"]), best
 
-        # First pass: find people who have nominated each other as roommates and assign them to the same room.
-        nominated = self.assign_nominated()
-        print("\nThe following rooms were assigned based on nominated roommates:")
-        for r in nominated:
-            print(f"\n{r}:")
-            r.print_roommates()
+    @profiled("improve_allocation")
+    def improve_allocation(
+            self,
+            max_iterations: int = 100000,
+            time_budget: float = None,
+            seed: int = 0,
+            temperature: float = 0.,
+            pack: bool = None
+    ):
+        """
+        Improves the finished allocation by moving single people and swapping pairs between rooms, by hill climbing or
+        simulated annealing; see hwsa.localsearch.improve().
+        :param max_iterations: Number of moves to try.
+        :param time_budget: Wall time in seconds after which to stop, if sooner.
+        :param seed: Seed for choosing moves.
+        :param temperature: Starting temperature for simulated annealing; with 0, only improvements are kept.
+        :param pack: Whether to keep people in as few rooms as possible, rather than evening out occupancy; if None,
+            rooms are packed when any of them has a cost.
+        :return: dict of the search's results, from hwsa.localsearch.improve().
+        """
+        if pack is None:
+            pack = any(map(lambda r: r.cost_per_bed() > 0, self.rooms))
+        result = localsearch.improve(
+            self,
+            max_iterations=max_iterations,
+            time_budget=time_budget,
+            seed=seed,
+            temperature=temperature,
+            pack=pack
+        )
+        self.count("local_search_moves", result["iterations"])
+        return result
 
+    def print_nominee_failed(self):
         print("\nThe following attendees have nominated roommates but have not been assigned them:")
         nominee_failed = list(
             filter(
@@ -291,37 +1051,272 @@ class Event:
                 self.attendees
             )
         )
+        positions = dict(map(lambda item: (id(item[1]), item[0]), enumerate(self.attendees)))
         for p in nominee_failed:
-            nominee = self.find_name(p.roommate_nominee)
+            nominee = self.find_name(p.roommate_nominee, positions=positions)
             add_str = ""
             if nominee is None:
                 add_str = "; attendee not found"
             print("\t", str(p), f"(nominated {p.roommate_nominee}{add_str})")
 
-        # Second pass: assign roomless people based on gender
-        # Note: Even if someone has multiple or no preferences, have it try to assign to same gender first
-        # But prioritise people with specified preferences, the fewer the earlier
+    def allocate_roommates(
+            self,
+            email_template_path: str = None,
+            method: str = "greedy",
+            output_format: str = "jsonl",
+            yaml_tree: bool = False,
+            email_format: str = "files",
+            multistart_kwargs: dict = None,
+            improve_kwargs: dict = None
+    ):
+        """
+        Assigns rooms to all attendees who need one, prints a report and writes the outputs.
+        :param email_template_path: Path to the roommate email template; if None, no emails are generated.
+        :param method: "greedy", for the nominee, gender and preference passes; "optimal", to solve for the whole
+            allocation at once with assign_optimal(); or "multistart", for the best of many shuffled runs of the greedy
+            passes, with assign_multistart().
+        :param output_format: Format of the store that all rooms and attendees are written to; see write_store().
+        :param yaml_tree: If True, also write a YAML file for every room and attendee, generated from the store.
+        :param email_format: How to write the roommate emails; see generate_roommate_emails().
+        :param multistart_kwargs: Arguments for assign_multistart(), when method is "multistart".
+        :param improve_kwargs: If given, improve_allocation() is run with these arguments once everyone is placed; after
+            the optimal allocator, it packs rooms unless told otherwise.
+        """
+        if method not in allocation_methods:
+            raise ValueError(f"Unrecognised allocation method {method}; must be one of {allocation_methods}.")
 
-        gendered = self.assign_by_gender()
-        print("\nThe following rooms were assigned based on attendee gender:")
-        if not gendered:
-            print("None")
-        for r in gendered:
-            print(f"\n{r}:")
-            r.print_roommates()
+        # Zeroth pass: ingest rooms that have been assigned manually
+        with self.timed("manual_ingest"):
+            for room in self.rooms:
+                room.update_manual()
+
+        if method == "optimal":
+            optimised = self.assign_optimal()
+            print("\nThe following rooms were assigned by the optimal allocator:")
+            if not optimised:
+                print("None")
+            for r in optimised:
+                print(f"\n{r}:")
+                r.print_roommates()
+
+            self.print_nominee_failed()
+
+        elif method == "multistart":
+            searched, best = self.assign_multistart(**(multistart_kwargs or {}))
+            print(
+                f"\nBest of {best['starts']} shuffled greedy allocations (seed {best['seed']}): "
+                f"{best['terms']['roomless']} roomless, {best['terms']['nominee_failed']} without their nominee, "
+                f"{best['terms']['empty_rooms']} empty rooms, occupancy standard deviation "
+                f"{best['terms']['imbalance']:.3f}."
+            )
+            print("\nThe following rooms were assigned by the multi-start search:")
+            if not searched:
+                print("None")
+            for r in searched:
+                print(f"\n{r}:")
+                r.print_roommates()
+
+            self.print_nominee_failed()
+
+        else:
+            # First pass: find people who have nominated each other as roommates and assign them to the same room.
+            nominated = self.assign_nominated()
+            print("\nThe following rooms were assigned based on nominated roommates:")
+            for r in nominated:
+                print(f"\n{r}:")
+                r.print_roommates()
+
+            self.print_nominee_failed()
+
+            # Then put anyone who needs an accessible room in one, before the other passes can fill them
+            accessible = self.assign_accessible()
+            if accessible:
+                print("\nThe following rooms were assigned to attendees needing an accessible room:")
+                for r in accessible:
+                    print(f"\n{r}:")
+                    r.print_roommates()
+
+            # Second pass: assign roomless people based on gender
+            # Note: Even if someone has multiple or no preferences, have it try to assign to same gender first
+            # But prioritise people with specified preferences, the fewer the earlier
+
+            gendered = self.assign_by_gender()
+            print("\nThe following rooms were assigned based on attendee gender:")
+            if not gendered:
+                print("None")
+            for r in gendered:
+                print(f"\n{r}:")
+                r.print_roommates()
+
+            # Third pass: assign still-roomless people based on listed preferences
+
+            preferred = self.assign_by_preference()
+            print("\nThe following rooms were assigned based on gender PREFERENCE:")
+            if not preferred:
+                print("None")
+            for r in preferred:
+                print(f"\n{r}:")
+                r.print_roommates()
+
+        if improve_kwargs is not None:
+            if method == "optimal":
+                improve_kwargs = dict(improve_kwargs)
+                improve_kwargs.setdefault("pack", True)
+            improved = self.improve_allocation(**improve_kwargs)
+            initial, final = improved["initial"], improved["final"]
+            print(
+                f"\nLocal search kept {improved['accepted']} of {improved['iterations']} moves tried: roomless "
+                f"{initial['roomless']} -> {final['roomless']}, without their nominee {initial['nominee_failed']} -> "
+                f"{final['nominee_failed']}, empty rooms {initial['empty_rooms']} -> {final['empty_rooms']}."
+            )
+            print("\nThe following rooms were changed by the local search:")
+            if not improved["rooms"]:
+                print("None")
+            for r in improved["rooms"]:
+                print(f"\n{r}:")
+                r.print_roommates()
+            self.print_nominee_failed()
+
+        self.print_allocation_report()
+
+        self.write_rooms()
+        self.write_attendee_table()
+        store_path = self.write_store(output_format=output_format)
+        if yaml_tree:
+            self.write_yaml_tree(store_path=store_path)
+        if isinstance(email_template_path, str):
+            self.generate_roommate_emails(email_template_path, output_format=email_format)
+
+    def allocate_incremental(
+            self,
+            previous_output: str = None,
+            email_template_path: str = None,
+            output_format: str = "jsonl",
+            yaml_tree: bool = False,
+            email_format: str = "files"
+    ):
+        """
+        Updates a previous run's allocation for changed registrations, instead of allocating everyone afresh.
+        Attendees are matched to the previous run by id. Anyone whose name, gender, preferences, nominee and
+        registration type are unchanged keeps their room; cancelled registrations are dropped; and new or changed
+        attendees (and anyone whose room no longer exists) are placed around them with the greedy passes.
+        Only the files of rooms and attendees affected by the changes are rewritten in the YAML tree, and only their
+        emails are regenerated when writing a file per attendee.
+        :param previous_output: Output directory of the previous run; defaults to this event's output directory. Its
+            store (see write_store()) is read if there is one, or else its rooms.yaml.
+        :param email_template_path: Path to the roommate email template; if None, no emails are generated.
+        :param output_format: Format of the store; see write_store().
+        :param yaml_tree: If True, write the YAML tree in full if there isn't one yet.
+        :param email_format: How to write the roommate emails; see generate_roommate_emails().
+        :return: dict of the lists of "unchanged", "changed" and "new" attendees, "cancelled" attendee ids, and the
+            "rooms" whose occupants have changed; or None if there was no previous run, in which case everyone is
+            allocated with allocate_roommates().
+        """
+        if previous_output is None:
+            previous_output = self.output
+        previous = PreviousAllocation.from_output(previous_output, people=self.attendees)
+        if previous is None:
+            print(f"No previous allocation found in {previous_output}; allocating all rooms.")
+            self.allocate_roommates(
+                email_template_path=email_template_path,
+                output_format=output_format,
+                yaml_tree=yaml_tree,
+                email_format=email_format
+            )
+            return None
 
-        # Third pass: assign still-roomless people based on listed preferences
+        with self.timed("diff_registrations"):
+            diff = diff_registrations(self.attendees, previous)
+        print(
+            f"\nCompared with the previous allocation: {len(diff['unchanged'])} unchanged, {len(diff['changed'])} "
+            f"changed, {len(diff['new'])} new and {len(diff['cancelled'])} cancelled registrations."
+        )
 
+        with self.timed("manual_ingest"):
+            for room in self.rooms:
+                room.update_manual()
+
+        with self.timed("restore_rooms"):
+            unchanged = dict(map(lambda p: (str(p.id), p), diff["unchanged"]))
+            rooms_by_name = dict(map(lambda r: (str(r), r), self.rooms))
+            for room_name, occupants in previous.rooms.items():
+                room = rooms_by_name.get(room_name)
+                if room is None:
+                    continue
+                for key in occupants:
+                    person = unchanged.get(key)
+                    # The attendee's own record has the final say if they were somehow listed in more than one room
+                    if person is None or previous.attendees[key].get("room") != room_name or person.has_room():
+                        continue
+                    room.add_roommate(person, override_suitable=True)
+
+        nominated = self.assign_nominated()
+        accessible = self.assign_accessible()
+        gendered = self.assign_by_gender()
         preferred = self.assign_by_preference()
-        print("\nThe following rooms were assigned based on gender PREFERENCE:")
-        if not preferred:
+        placed = []
+        for room in nominated + accessible + gendered + preferred:
+            if room not in placed:
+                placed.append(room)
+        print("\nThe following rooms have had people placed in them:")
+        if not placed:
             print("None")
-        for r in preferred:
+        for r in placed:
             print(f"\n{r}:")
             r.print_roommates()
+        self.print_nominee_failed()
+        self.print_allocation_report()
+
+        diff["rooms"] = list(filter(
+            lambda r: list(map(lambda p: str(p.id), r.roommates)) != previous.rooms.get(str(r), []),
+            self.rooms
+        ))
+        print("\nRooms whose occupants have changed since the previous allocation:")
+        if not diff["rooms"]:
+            print("None")
+        for r in diff["rooms"]:
+            print("\t", r)
+
+        # Anyone who has changed, moved, or has a new roommate
+        touched = {}
+        for person in diff["new"] + diff["changed"]:
+            touched[id(person)] = person
+        for person in diff["unchanged"]:
+            room_name = str(person.room) if person.has_room() else str(None)
+            if room_name != previous.attendees[str(person.id)].get("room"):
+                touched[id(person)] = person
+        for room in diff["rooms"]:
+            for person in room.roommates:
+                touched[id(person)] = person
+        touched = list(touched.values())
+
+        self.write_rooms()
+        self.write_attendee_table()
+        self.write_store(output_format=output_format)
+        dirs = store.yaml_tree_dirs(self.output)
+        if any(map(os.path.isdir, dirs.values())):
+            with self.timed("write_yaml_tree"):
+                for key in diff["cancelled"] + list(map(lambda p: str(p.id), diff["changed"])):
+                    if key in previous.filenames:
+                        path = os.path.join(dirs["attendee"], previous.filenames[key] + ".yaml")
+                        if os.path.isfile(path):
+                            os.remove(path)
+                store.write_yaml_records(store.store_records(rooms=diff["rooms"], attendees=touched), self.output)
+        elif yaml_tree:
+            self.write_yaml_tree()
+        if isinstance(email_template_path, str):
+            self.generate_roommate_emails(
+                email_template_path,
+                output_format=email_format,
+                people=touched if email_format == "files" else None
+            )
+        return diff
 
+    @profiled("report")
+    def print_allocation_report(self):
         print("\nAll rooms:")
-        self.rooms.sort(key=lambda r: r.id)
+        # Numbered rooms first, so that rooms given a mix of numbers and names can still be sorted
+        self.rooms.sort(key=lambda r: (isinstance(r.id, str), r.id))
         for r in self.rooms:
             if not r.empty():
                 print(f"\n{r}:")
@@ -380,20 +1375,32 @@ class Event:
         print("\tThey will nominate a roommate later:", sum(map(lambda p: p.will_nominate == "later", self.attendees)))
         print("\tThey need a roommate allocated:", sum(map(lambda p: p.will_nominate == "no", self.attendees)))
 
-        self.write_rooms()
-        self.write_room_yamls()
-        self.write_attendee_table()
-        self.write_attendee_yamls()
-        if isinstance(email_template_path, str):
-            self.generate_roommate_emails(email_template_path)
-
+    @profiled("generate_roommate_emails")
     def generate_roommate_emails(
             self,
             template_path: str = None,
             rm_line=None,
             no_rm_line=None,
-            output_dir: str = None
+            output_dir: str = None,
+            output_format: str = "files",
+            n_threads: int = 1,
+            people: list = None
     ):
+        """
+        Renders the roommate email for everyone with a room, compiling the template once, and writes them out.
+        :param template_path: Path to the template, with {name} and {roommate_line} fields; defaults to
+            output/roommate_email_template.txt.
+        :param rm_line: The roommate line, with an {rms} field for the roommates' names.
+        :param no_rm_line: The roommate line for someone alone in their room.
+        :param output_dir: Directory to write to; defaults to output/roommate_emails.
+        :param output_format: "files", for a file per attendee; "jsonl", for all emails in roommate_emails.jsonl; or
+            "mbox", for all emails in roommate_emails.mbox.
+        :param n_threads: Number of threads to write the files with, when output_format is "files".
+        :param people: Attendees to generate emails for; defaults to everyone.
+        :return: list of (Attendee, email) tuples.
+        """
+        if output_format not in emails.email_formats:
+            raise ValueError(f"Unrecognised email format {output_format}; must be one of {emails.email_formats}.")
         if template_path is None:
             template_path = os.path.join(self.output, "roommate_email_template.txt")
         if output_dir is None:
@@ -401,83 +1408,62 @@ class Event:
         u.mkdir_check(output_dir)
         with open(template_path, "r") as tmp:
             template = tmp.read()
-        for p in self.attendees:
-            p.generate_roommate_email(
-                template=template,
-                rm_line=rm_line,
-                no_rm_line=no_rm_line,
-                output_dir=output_dir
-            )
-
+        rendered = emails.render_roommate_emails(
+            people=self.attendees if people is None else people,
+            template=template,
+            rm_line=rm_line,
+            no_rm_line=no_rm_line
+        )
+        if output_format == "jsonl":
+            emails.write_email_jsonl(rendered, os.path.join(output_dir, "roommate_emails.jsonl"))
+        elif output_format == "mbox":
+            emails.write_email_mbox(rendered, os.path.join(output_dir, "roommate_emails.mbox"))
+        else:
+            emails.write_email_files(rendered, output_dir=output_dir, n_threads=n_threads)
+        return rendered
+
+    @profiled("write_rooms")
     def write_rooms(self):
         room_dict = {}
         for room in self.rooms:
             room_dict[room.id] = room.list_roommates()
         u.save_params(os.path.join(self.output, "rooms.yaml"), room_dict)
 
-    def write_room_yamls(self):
-        yaml_dir = os.path.join(self.output, "rooms")
-        u.mkdir_check(yaml_dir)
-        for p in self.rooms:
-            yml = p.to_yaml()
-            u.save_params(
-                os.path.join(yaml_dir, p.filename()),
-                yml
-            )
-
-    def add_diet(self, person: Attendee):
-        _add_property(
-            person=person,
-            prop=person.diet,
-            property_dict=self.diets,
-            type_expect=str
-        )
-
-    def add_affiliation(self, person: Attendee):
-        _add_property(
-            person=person,
-            prop=person.affiliation,
-            property_dict=self.affiliations,
-            type_expect=str
-        )
-
-    def add_accessibility(self, person: Attendee):
-        _add_property(
-            person=person,
-            prop=person.accessibility,
-            property_dict=self.accessibility,
-            type_expect=str
-        )
-
-    def add_stage(self, person: Attendee):
-        _add_property(
-            person=person,
-            prop=person.career_stage,
-            property_dict=self.career_stages,
-            type_expect=str
-        )
+    def collect_properties(self):
+        """
+        Builds every category breakdown (diets, affiliations, accessibility, career stages and genders) in a single
+        pass over the attendees, or returns the ones already built if self.attendees hasn't changed since.
+        Each breakdown maps a value to the list of people with it, in the order they appear in self.attendees.
+        :return: dict of breakdowns, keyed by the name of the Event attribute each is stored in.
+        """
+        attendee_ids = list(map(id, self.attendees))
+        if attendee_ids == self.properties_collected_for:
+            return dict(map(lambda name: (name, getattr(self, name)), property_attributes))
+        # Insertion-ordered sets, so that membership checks don't scan the lists
+        collected = dict(map(lambda name: (name, {}), property_attributes))
+        for person in self.attendees:
+            for name, (attribute, type_expect) in property_attributes.items():
+                prop = getattr(person, attribute)
+                if isinstance(prop, type_expect):
+                    collected[name].setdefault(prop, {}).setdefault(person)
+        for name, property_dict in collected.items():
+            setattr(self, name, dict(map(lambda item: (item[0], list(item[1])), property_dict.items())))
+        self.properties_collected_for = attendee_ids
+        return dict(map(lambda name: (name, getattr(self, name)), property_attributes))
 
     def get_diets(self):
-        for p in self.attendees:
-            self.add_diet(p)
-        return self.diets
+        return self.collect_properties()["diets"]
 
     def get_stages(self):
-        for p in self.attendees:
-            self.add_stage(p)
-        return self.diets
+        return self.collect_properties()["career_stages"]
 
     def get_affiliations(self):
-        for p in self.attendees:
-            self.add_affiliation(p)
-        return self.affiliations
+        return self.collect_properties()["affiliations"]
 
     def get_accessibility(self):
-        for p in self.attendees:
-            self.add_accessibility(p)
-        return self.accessibility
+        return self.collect_properties()["accessibility"]
 
-    def _show_property(self, property_dict: dict, output_name: str, show_all: bool = False):
+    def _show_property(self, property_dict: dict, output_name: str, show_all: bool = False, plot: bool = True):
         str_dict = {}
         numbers = {}
         fractions = {}
@@ -486,16 +1472,10 @@ class Event:
         property_list.sort()
         n_with = 0
 
-        plt.close()
-        fig, ax = plt.subplots(figsize=(4,3))
-        title = output_name.replace("_", " ")
-        title = title[0].upper() + title[1:]
-        ax.set_title(title)
-
-        for i, property_name in enumerate(property_list):
+        for property_name in property_list:
             people = property_dict[property_name]
             str_dict[property_name] = list(map(lambda p: str(p), filter(lambda p: not p.loc, people)))
-            n = numbers[property_name] = len(str_dict[property_name])
+            numbers[property_name] = len(str_dict[property_name])
             fractions[property_name] = len(people) / len(self.attendees)
             percentages[property_name] = fractions[property_name] * 100
             n_with += numbers[property_name]
@@ -504,19 +1484,6 @@ class Event:
                 for p in people:
                     print("\t\t", p)
 
-            if n == 1:
-                ps = "person"
-            else:
-                ps = "people"
-            plt.bar(
-                x=i,
-                height=numbers[property_name],
-                label=f"{property_name} ({n} {ps}; {np.round(percentages[property_name], 1)}%)",
-                color=colours[i],
-                align='center',
-                edgecolor="black"
-            )
-
         write_dict = {
             "People": str_dict,
             "Numbers": numbers,
@@ -526,117 +1493,229 @@ class Event:
             "n_with": n_with
         }
 
-        plt.xticks([])
-        plt.legend(
-            loc=(1.1, 0),
-            # bbox_to_anchor=(0, -0.1)
-        )
-        plt.savefig(os.path.join(self.output, f"{output_name}.pdf"), bbox_inches="tight")
-        plt.savefig(os.path.join(self.output, f"{output_name}.png"), bbox_inches="tight")
-        plt.close()
+        if plot:
+            plot_property(output=self.output, output_name=output_name, bars=_property_bars(write_dict))
         u.save_params(file=os.path.join(self.output, f"{output_name}.yaml"), dictionary=write_dict)
         return write_dict
 
-    def show_stages(self, show_all: bool = False):
+    def show_stages(self, show_all: bool = False, plot: bool = True):
         self.get_stages()
         print("Career Stages:")
-        return self._show_property(output_name="career_stages", show_all=show_all, property_dict=self.career_stages)
+        return self._show_property(
+            output_name="career_stages",
+            show_all=show_all,
+            property_dict=self.career_stages,
+            plot=plot
+        )
 
-    def show_affiliations(self, show_all: bool = False):
+    def show_affiliations(self, show_all: bool = False, plot: bool = True):
         self.get_affiliations()
         print("Affiliations:")
-        return self._show_property(output_name="affiliations", show_all=show_all, property_dict=self.affiliations)
+        return self._show_property(
+            output_name="affiliations",
+            show_all=show_all,
+            property_dict=self.affiliations,
+            plot=plot
+        )
 
-    def show_diets(self, show_all: bool = True):
+    def show_diets(self, show_all: bool = True, plot: bool = True):
         self.get_diets()
         print("Dietary Requirements:")
-        info = self._show_property(output_name="diet", show_all=show_all, property_dict=self.diets)
+        info = self._show_property(output_name="diet", show_all=show_all, property_dict=self.diets, plot=plot)
         print(f"\n{info['n_distinct']} distinct dietary requirements.")
         print(f"{info['n_with']} total attendees with dietary requirements.")
         return info
 
-    def show_accessibility(self, show_all: bool = True):
+    def show_accessibility(self, show_all: bool = True, plot: bool = True):
         self.get_accessibility()
         print("Accessibility Requirements:")
-        return self._show_property(output_name="accessibility", show_all=show_all, property_dict=self.accessibility)
+        return self._show_property(
+            output_name="accessibility",
+            show_all=show_all,
+            property_dict=self.accessibility,
+            plot=plot
+        )
 
-    def show_genders(self, show_all: bool = False):
+    def show_genders(self, show_all: bool = False, plot: bool = True):
         self.get_genders()
         print("Gender mix:")
-        return self._show_property(output_name="gender", show_all=show_all, property_dict=self.genders)
+        return self._show_property(output_name="gender", show_all=show_all, property_dict=self.genders, plot=plot)
+
+    @profiled("show_report")
+    def show_report(self, plot: bool = True, n_processes: int = 1):
+        """
+        Prints and writes all five breakdowns (affiliations, career stages, diets, accessibility and genders), then
+        draws their charts together at the end.
+        :param plot: If False, only the printout and YAML files are produced.
+        :param n_processes: Number of worker processes to draw the charts in; with 1, they are all drawn in this
+            process.
+        :return: dict of the information returned by each show_* method, keyed by output name.
+        """
+        shows = {
+            "affiliations": self.show_affiliations,
+            "career_stages": self.show_stages,
+            "diet": self.show_diets,
+            "accessibility": self.show_accessibility,
+            "gender": self.show_genders,
+        }
+        infos = {}
+        for i, (output_name, show) in enumerate(shows.items()):
+            if i > 0:
+                print("\n\n")
+            infos[output_name] = show(plot=False)
+
+        if plot:
+            output_names = list(infos.keys())
+            bars = list(map(lambda name: _property_bars(infos[name]), output_names))
+            outputs = [self.output] * len(output_names)
+            if n_processes > 1:
+                with ProcessPoolExecutor(max_workers=n_processes) as executor:
+                    list(executor.map(plot_property, outputs, output_names, bars))
+            else:
+                list(map(plot_property, outputs, output_names, bars))
+        return infos
 
     def to_dataframe(self):
-        attendee_dicts = list(map(lambda a: a.__dict__, self.attendees))
-        df = pd.DataFrame.from_dict(data=attendee_dicts)
+        # Built column by column straight from the attendees' slots, rather than from a dict per attendee
+        df = pd.DataFrame.from_records(
+            list(map(operator.attrgetter(*Attendee.fields), self.attendees)),
+            columns=Attendee.fields
+        )
+        extras = list(map(lambda a: a.extra or {}, self.attendees))
+        extra_keys = {}
+        for extra in extras:
+            extra_keys.update(dict.fromkeys(extra))
+        for key in extra_keys:
+            df[key] = list(map(lambda e: e.get(key, np.nan), extras))
         return df
 
+    @profiled("write_attendee_table")
     def write_attendee_table(self):
         df = self.to_dataframe()
         df.to_csv(os.path.join(self.output, "attendees.csv"))
 
-    def write_attendee_yamls(self):
-        yaml_dir = os.path.join(self.output, "attendees")
-        u.mkdir_check(yaml_dir)
-        for p in self.attendees:
-            yml = p.to_yaml()
-            u.save_params(
-                os.path.join(yaml_dir, p.filename()),
-                yml
+    @profiled("write_store")
+    def write_store(self, output_format: str = "jsonl"):
+        """
+        Writes every room and attendee to a single file, instead of a YAML file each.
+        :param output_format: "jsonl" for JSON lines (output/allocation.jsonl), or "sqlite" for a SQLite database
+            (output/allocation.sqlite).
+        :return: Path to the store.
+        """
+        if output_format not in store.store_extensions:
+            raise ValueError(
+                f"Unrecognised output format {output_format}; must be one of {list(store.store_extensions)}."
             )
-
+        path = os.path.join(self.output, "allocation" + store.store_extensions[output_format])
+        store.write_store(path, store.store_records(rooms=self.rooms, attendees=self.attendees))
+        return path
+
+    @profiled("write_yaml_tree")
+    def write_yaml_tree(self, store_path: str = None):
+        """
+        Writes a YAML file for each room (output/rooms/) and attendee (output/attendees/) from a store written by
+        write_store().
+        :param store_path: Path to the store; if None, one is written first.
+        """
+        if store_path is None:
+            store_path = self.write_store()
+        store.write_yaml_tree(store_path=store_path, output=self.output)
+
+    @profiled("check_for_duplicates")
     def check_for_duplicates(self, show=True):
-        possible = []
-        confirmed = []
         self.attendees.sort(key=lambda p: p.name_family)
-        for person in self.attendees:
-            for other in self.attendees:
-                if other is not person and other.loose_match(f"{person.name_given} {person.name_family}"):
-                    if other.email == person.email:
-                        confirmed.append((person, other))
-                        self.attendees.remove(other)
-                    else:
-                        possible.append((person, other))
+        possible, confirmed = find_duplicates(self.attendees)
+        # The first of each confirmed cluster is kept; only remove the others once the scan is done.
+        self.remove_attendees([other for cluster in confirmed for other in cluster[1:]])
 
         if show:
             print("\nPossible duplicates:")
             if not possible:
                 print("None")
-            for p1, p2 in possible:
-                print(f"\t{p1} of {p2}")
+            for cluster in possible:
+                for other in cluster[1:]:
+                    print(f"\t{other} of {cluster[0]}")
 
             print("\nConfirmed duplicates (removed automatically):")
             if not confirmed:
                 print("None")
-            for p1, p2 in confirmed:
-                print(f"\t{p1} of {p2}")
+            for cluster in confirmed:
+                for other in cluster[1:]:
+                    print(f"\t{other} of {cluster[0]}")
 
         return possible, confirmed
 
+    @profiled("write_snapshot")
+    def write_snapshot(self, path: str = None):
+        """
+        Saves the whole state of the event (attendees, rooms, nominee links and room assignments) as a pickle, which
+        from_snapshot() restores, so that later phases can be rerun without reading and allocating everyone again.
+        :param path: Path to write to; defaults to output/event.snapshot.
+        :return: The path written to.
+        """
+        if path is None:
+            path = os.path.join(self.output, snapshot_filename)
+        # The version goes in a pickle of its own ahead of the event, so that it can be checked before unpickling the
+        # rest
+        with u.atomic_write(path) as file:
+            pickle.dump({"version": snapshot_version}, file, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+        return path
+
+    @classmethod
+    def from_snapshot(cls, path: str, **kwargs):
+        """
+        Restores an Event saved by write_snapshot().
+        :param path: Path to the snapshot, or to an output directory holding one.
+        :param kwargs: Attributes to set on the restored Event, eg output.
+        :return: The Event.
+        """
+        if os.path.isdir(path):
+            path = os.path.join(path, snapshot_filename)
+        start = time.perf_counter()
+        with open(path, "rb") as file:
+            header = pickle.load(file)
+            if not isinstance(header, dict) or header.get("version") != snapshot_version:
+                raise ValueError(
+                    f"{path} is not a snapshot from this version of hwsa (snapshot version {snapshot_version}); rerun "
+                    f"the allocation to write a new one."
+                )
+            event = pickle.load(file)
+        for key, value in kwargs.items():
+            setattr(event, key, value)
+        event.record_phase("read_snapshot", time.perf_counter() - start)
+        return event
+
     @classmethod
-    def from_mq_xl(cls, path: str, **kwargs):
+    def from_mq_xl(cls, path: str, cache: bool = True, cache_dir: str = None, **kwargs):
+        """
+        Builds an Event from a Macquarie-generated XLSX of registrations.
+        :param path: Path to the XLSX.
+        :param cache: If True, use the parsed-registration cache (see hwsa.ingest.read_mq_xl_cached()); otherwise
+            stream the XLSX every time.
+        :param cache_dir: Directory for the cache; defaults to .hwsa_cache next to the XLSX.
+        :param kwargs: passed to Event().
+        :return: The Event.
+        """
         if not path.endswith(".xlsx"):
             path += ".xlsx"
-        xl = pd.read_excel(path)
-
-        true_names = []
-        for name_1 in xl:
-            name_2 = xl[name_1][0]
-            if "Value - Value" in name_2:
-                true_names.append(name_1)
-            else:
-                true_names.append(name_2)
-
-        xl_mod = xl.drop(0)
-        xl_mod.columns = true_names
-
-        xl_mod.to_csv(
-            path.replace(".xlsx", ".csv")
-        )
+        csv_path = path.replace(".xlsx", ".csv")
+        start = time.perf_counter()
+        if cache:
+            columns, rows = read_mq_xl_cached(path, csv_path=csv_path, cache_dir=cache_dir)
+            read_time = time.perf_counter() - start
+        else:
+            # The rows are streamed as the attendees are built, so reading is timed along with that
+            columns, rows = read_mq_xl(path, csv_path=csv_path)
+            read_time = None
 
         event = Event(**kwargs)
-        for row in xl_mod.iloc:
-            person = Attendee.from_mq_xl_row(row=row, event=event)
-            event.add_attendee(person=person)
+        with event.timed("build_attendees"):
+            for row in rows:
+                person = Attendee.from_mq_xl_values(row=row, columns=columns, event=event)
+                event.add_attendee(person=person)
+        if read_time is not None:
+            event.record_phase("read_registrations", read_time)
 
         return event
 
@@ -654,9 +1733,67 @@ def nominees_match(person_1: 'Attendee', person_2: 'Attendee'):
             return True
 
 
-def _add_property(person: Attendee, prop, property_dict: dict, type_expect=str):
-    if isinstance(prop, type_expect):
-        if prop not in property_dict:
-            property_dict[prop] = []
-        if person not in property_dict[prop]:
-            property_dict[prop].append(person)
+def may_share(person_1: 'Attendee', person_2: 'Attendee'):
+    """
+    Whether two people may be put in a room together: if they are compatible, or if one has nominated the other and
+    nominees_match() lets the nomination override their preferences.
+    """
+    return compatible_roommates(person_1, person_2) or bool(nominees_match(person_1, person_2)) \
+        or bool(nominees_match(person_2, person_1))
+
+
+def _property_bars(info: dict):
+    # One (height, label, colour) for each bar of a breakdown chart, from the dict returned by Event._show_property()
+    bars = []
+    for i, property_name in enumerate(info["Numbers"]):
+        n = info["Numbers"][property_name]
+        if n == 1:
+            ps = "person"
+        else:
+            ps = "people"
+        label = f"{property_name} ({n} {ps}; {np.round(info['Percentages'][property_name], 1)}%)"
+        bars.append((n, label, colours[i]))
+    return bars
+
+
+def plot_property(output: str, output_name: str, bars: list):
+    """
+    Draws a breakdown chart and saves it as PDF and PNG.
+    matplotlib is only imported here, and the figure is built without pyplot (and so renders through Agg rather than
+    any interactive backend), so that runs which draw nothing don't pay for it and charts can be drawn in worker
+    processes.
+    :param output: Directory to save the chart in.
+    :param output_name: Name of the breakdown, used for the title and file names.
+    :param bars: list of (height, label, colour) tuples, from _property_bars().
+    """
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(4, 3))
+    ax = fig.subplots()
+    title = output_name.replace("_", " ")
+    title = title[0].upper() + title[1:]
+    ax.set_title(title)
+    for i, (height, label, colour) in enumerate(bars):
+        ax.bar(
+            x=i,
+            height=height,
+            label=label,
+            color=colour,
+            align='center',
+            edgecolor="black"
+        )
+    ax.set_xticks([])
+    ax.legend(
+        loc=(1.1, 0),
+        # bbox_to_anchor=(0, -0.1)
+    )
+    fig.savefig(os.path.join(output, f"{output_name}.pdf"), bbox_inches="tight")
+    fig.savefig(os.path.join(output, f"{output_name}.png"), bbox_inches="tight")
+
+
+def _name_grams(name: str, length: int):
+    return map(lambda start: name[start:start + length], range(len(name) - length + 1))
+
+
+def _name_token_set(person: Attendee):
+    return set(u.name_tokens(person.name_given) + u.name_tokens(person.name_family))
@@ -0,0 +1,121 @@
+import math
+import os
+
+import hwsa.store as store
+import hwsa.utils as u
+
+# The attendee fields that the allocation depends on; anyone whose values for these differ from the previous run is
+# taken out of their room and placed again.
+allocation_fields = (
+    "name_given",
+    "name_family",
+    "gender",
+    "room_preferences",
+    "roommate_nominee",
+    "registration_type",
+)
+
+
+class PreviousAllocation:
+    """
+    The rooms and attendees of an earlier run, read back from its outputs.
+    :param attendees: dict of attendee record data (as from Attendee.to_yaml()), keyed by str(id).
+    :param rooms: dict of str(Room) to the list of str(id) of its occupants, in order.
+    :param filenames: dict of str(id) to the filename() of the attendee's entry in the YAML tree.
+    """
+
+    def __init__(self, attendees: dict, rooms: dict, filenames: dict = None):
+        self.attendees = attendees
+        self.rooms = rooms
+        self.filenames = filenames or {}
+
+    @classmethod
+    def from_store(cls, path: str):
+        """
+        Reads a previous run from the store written by Event.write_store().
+        """
+        attendees = {}
+        filenames = {}
+        ids = {}
+        records = store.read_store(path)
+        for record in filter(lambda r: r["kind"] == "attendee", records):
+            key = str(record["data"]["id"])
+            attendees[key] = record["data"]
+            filenames[key] = record["filename"]
+            ids[record["data"].get("name_str")] = key
+        rooms = {}
+        for record in filter(lambda r: r["kind"] == "room", records):
+            occupants = filter(lambda k: k is not None, map(ids.get, record["data"]["roommates"]))
+            rooms[f"Room {record['data']['id']}"] = list(occupants)
+        return cls(attendees=attendees, rooms=rooms, filenames=filenames)
+
+    @classmethod
+    def from_rooms_yaml(cls, path: str, people: list):
+        """
+        Reads a previous run from its rooms.yaml alone, which only holds names. Occupants are matched to people by
+        full name and are assumed to be unchanged; names with no match are dropped.
+        """
+        by_name = {}
+        for person in people:
+            by_name.setdefault(person.full_name(), person)
+        attendees = {}
+        rooms = {}
+        for room_id, names in (u.load_params(path) or {}).items():
+            occupants = []
+            room_name = f"Room {room_id}"
+            for person in filter(None, map(by_name.get, names)):
+                key = str(person.id)
+                attendees[key] = person.to_yaml()
+                attendees[key]["room"] = room_name
+                occupants.append(key)
+            rooms[room_name] = occupants
+        return cls(attendees=attendees, rooms=rooms)
+
+    @classmethod
+    def from_output(cls, output: str, people: list):
+        """
+        Reads a previous run from an output directory, preferring its store (allocation.jsonl or allocation.sqlite) and
+        falling back on rooms.yaml.
+        :return: The PreviousAllocation, or None if there are no previous outputs.
+        """
+        for extension in store.store_extensions.values():
+            path = os.path.join(output, "allocation" + extension)
+            if os.path.isfile(path):
+                return cls.from_store(path)
+        path = os.path.join(output, "rooms.yaml")
+        if os.path.isfile(path):
+            return cls.from_rooms_yaml(path, people)
+        return None
+
+
+def _same(value_1, value_2):
+    # NaNs come back from the store as new float objects, which never equal each other
+    if isinstance(value_1, float) and isinstance(value_2, float) and math.isnan(value_1) and math.isnan(value_2):
+        return True
+    return value_1 == value_2
+
+
+def diff_registrations(people: list, previous: PreviousAllocation):
+    """
+    Compares the current attendees with a previous run's by id.
+    :param people: list of current Attendees.
+    :param previous: The previous run.
+    :return: dict with "unchanged", "changed" and "new" (lists of current Attendees) and "cancelled" (list of str(id)
+        from the previous run that are no longer registered).
+    """
+    diff = {"unchanged": [], "changed": [], "new": [], "cancelled": []}
+    current = set()
+    for person in people:
+        key = str(person.id)
+        current.add(key)
+        old = previous.attendees.get(key)
+        if old is None:
+            diff["new"].append(person)
+            continue
+        new = person.to_yaml()
+        if all(map(lambda field: _same(new.get(field), old.get(field)), allocation_fields)):
+            diff["unchanged"].append(person)
+        else:
+            diff["changed"].append(person)
+    diff["cancelled"] = list(filter(lambda key: key not in current, previous.attendees))
+    return diff
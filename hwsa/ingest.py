@@ -0,0 +1,213 @@
+import csv
+import hashlib
+import os
+import pickle
+
+import numpy as np
+
+import hwsa.utils as u
+
+log = u.get_logger("ingest")
+
+# Bump this whenever a change here would alter the rows read from an export, so that old caches are ignored.
+parser_version = 1
+
+# The strings pandas reads as NaN by default, so that rows streamed from openpyxl come out the same as from
+# pd.read_excel().
+na_values = {
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA",
+    "NULL", "NaN", "None", "n/a", "nan", "null"
+}
+
+room_str = "Marketing - If we have to allocate you a roommate, who would you be comfortable sharing with?"
+research_str = "Marketing - Your Research/Thesis Technique"
+career_str = "Marketing - Current Academic/Career Stage"
+career_other_str = "Marketing - Academic Career stage (other)"
+research_other_str = "Marketing - Other Research/Thesis Technique"
+
+# Spreadsheet column for each Attendee attribute taken directly from a Macquarie export.
+mq_fields = {
+    "id": "ID",
+    "title": "Title",
+    "name_given": "First Name",
+    "name_family": "Last Name",
+    "phone": "Mobile Number",
+    "email": "Primary Email",
+    "diet": "Dietary Requirements",
+    "gender": "Marketing - Gender Identity",
+    "roommate_nominee": "Marketing - Nominated roommate",
+    "will_nominate": "Marketing - Would you like to nominate a roommate?",
+    "affiliation": "Marketing - Primary Affiliation",
+    "other_affiliations": "Marketing - Other Affiliations (if applicable)",
+    "research_topic": "Marketing - Your Research/Thesis Topic",
+    "other_research_topic": "Marketing - Other Research/Thesis Topic",
+    "registration_type": "Registration Type - Name",
+    "amount_outstanding": "Amount Outstanding",
+    "amount_required": "Amount Required",
+    "registered": "Date Registered",
+    "accessibility": "Marketing - Accessibility",
+}
+
+
+class MQColumns:
+    """
+    Where everything lives in the rows of a Macquarie export, worked out once from the column names so that each row
+    can be read by position.
+    """
+
+    def __init__(self, names: list):
+        self.names = list(names)
+        index = {}
+        for i, name in enumerate(self.names):
+            index.setdefault(name, i)
+        self.fields = {}
+        for attribute, name in mq_fields.items():
+            if name not in index:
+                raise KeyError(f"Column {name} not found in export.")
+            self.fields[attribute] = index[name]
+        self.career = index[career_str]
+        self.career_other = index.get(career_other_str)
+        self.research_other = index[research_other_str]
+        self.loc = index.get("LOC")
+        self.room_preferences = []
+        self.research_types = []
+        for i, name in enumerate(self.names):
+            if name.startswith(room_str):
+                self.room_preferences.append(i)
+            if name.startswith(research_str):
+                self.research_types.append(i)
+        # Columns that are always consumed; everything else is passed through to the Attendee as-is.
+        used = set(self.fields.values())
+        used.update((self.career, self.research_other))
+        # The optional columns are only consumed when they hold a string, so they are handled row by row.
+        self.conditional = set(self.room_preferences + self.research_types)
+        if self.career_other is not None:
+            self.conditional.add(self.career_other)
+        self.extra = list(filter(lambda i: i not in used and i not in self.conditional, range(len(self.names))))
+
+
+def _convert_cell(value):
+    # Mirrors pandas' handling of openpyxl cells
+    if value is None:
+        return np.nan
+    if isinstance(value, str):
+        if value in na_values:
+            return np.nan
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _mangle_names(names: list):
+    # As pandas does for blank and duplicated column names
+    counts = {}
+    mangled = []
+    for i, name in enumerate(names):
+        if name is None:
+            name = f"Unnamed: {i}"
+        name = str(name)
+        count = counts.get(name, 0)
+        while count > 0:
+            counts[name] = count + 1
+            name = f"{name}.{count}"
+            count = counts.get(name, 0)
+        counts[name] = count + 1
+        mangled.append(name)
+    return mangled
+
+
+def read_mq_xl(path: str, csv_path: str = None):
+    """
+    Streams the rows of a Macquarie-generated XLSX with openpyxl in read-only mode, without loading the workbook into
+    pandas.
+    The second row of the export holds the real column names, except where it reads "Value - Value", in which case the
+    first row does.
+    :param path: Path to the XLSX.
+    :param csv_path: If given, a CSV copy of the table (with the corrected column names) is written here as the rows
+        are read.
+    :return: tuple of (MQColumns, generator of row tuples)
+    """
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    sheet = workbook.worksheets[0]
+    rows = sheet.iter_rows(values_only=True)
+    header = list(next(rows))
+    while header and header[-1] is None:
+        header.pop()
+    header = _mangle_names(header)
+    width = len(header)
+    sub_header = list(next(rows))[:width]
+    sub_header += [None] * (width - len(sub_header))
+
+    true_names = []
+    for name_1, name_2 in zip(header, sub_header):
+        if not isinstance(name_2, str) or "Value - Value" in name_2:
+            true_names.append(name_1)
+        else:
+            true_names.append(name_2)
+    columns = MQColumns(true_names)
+
+    def generate():
+        csv_file = None
+        writer = None
+        if csv_path is not None:
+            csv_file = open(csv_path, "w", newline="")
+            writer = csv.writer(csv_file, lineterminator="\n")
+            writer.writerow([""] + true_names)
+        try:
+            n = 0
+            for row in rows:
+                row = row[:width]
+                if all(map(lambda v: v is None, row)):
+                    continue
+                row = tuple(map(_convert_cell, row)) + (np.nan,) * (width - len(row))
+                n += 1
+                if writer is not None:
+                    writer.writerow([n] + list(map(lambda v: "" if v is np.nan else v, row)))
+                yield row
+        finally:
+            if csv_file is not None:
+                csv_file.close()
+            workbook.close()
+
+    return columns, generate()
+
+
+def file_hash(path: str):
+    sha = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def read_mq_xl_cached(path: str, csv_path: str = None, cache_dir: str = None):
+    """
+    As read_mq_xl(), but keeps the parsed table in a pickle keyed on the export's content hash and the parser version,
+    so that re-reading an unchanged export skips the XLSX entirely (including writing the CSV copy).
+    :param path: Path to the XLSX.
+    :param csv_path: If given, a CSV copy of the table is written here when the XLSX has to be parsed.
+    :param cache_dir: Directory to keep the cache in; defaults to .hwsa_cache in the same directory as the XLSX.
+    :return: tuple of (MQColumns, list of row tuples)
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), ".hwsa_cache")
+    stem = os.path.splitext(os.path.basename(path))[0]
+    cache_path = os.path.join(cache_dir, f"{stem}_{file_hash(path)[:16]}_v{parser_version}.pickle")
+
+    if os.path.isfile(cache_path):
+        log.debug("Loading parsed registrations from %s", cache_path)
+        with open(cache_path, "rb") as file:
+            cached = pickle.load(file)
+        # Unpickled NaNs are new objects, but Attendee relies on empty cells being np.nan itself
+        rows = list(map(lambda r: tuple(map(lambda v: np.nan if v != v else v, r)), cached["rows"]))
+        return MQColumns(cached["names"]), rows
+
+    columns, rows = read_mq_xl(path, csv_path=csv_path)
+    rows = list(rows)
+    u.mkdir_check(cache_dir)
+    with u.atomic_write(cache_path) as file:
+        pickle.dump({"names": columns.names, "rows": rows}, file, protocol=pickle.HIGHEST_PROTOCOL)
+    return columns, rows
@@ -0,0 +1,268 @@
+import math
+import random
+import time
+
+import hwsa.utils as u
+from hwsa.multistart import score_weights
+
+log = u.get_logger("allocation")
+
+# Weights for allocations that are meant to use as few rooms as possible, as from the optimal allocator or for rooms
+# with costs: occupancy isn't evened out, and emptying a room counts in a move's favour.
+pack_weights = dict(score_weights, imbalance=0., empty_rooms=-1.)
+
+
+class AllocationScore:
+    """
+    Keeps the terms of hwsa.multistart.score_allocation() up to date as people are moved between rooms, so that the
+    change in score from a move can be worked out from the rooms and people it touches, without rescoring the event.
+    A move is a list of (Attendee, Room left or None, Room joined or None) tuples, all made at once.
+    """
+
+    def __init__(self, event: 'hwsa.event.Event', weights: dict = None):
+        if weights is None:
+            weights = score_weights
+        self.weights = weights
+        occupancy = list(map(lambda r: r.n_roommates(), event.rooms))
+        self.n_rooms = len(occupancy)
+        self.total = sum(occupancy)
+        self.total_squares = sum(map(lambda n: n * n, occupancy))
+        # The people who have nominated each person, keyed by id(); their nominee term can change when that person moves
+        self.nominators = {}
+        for person in event.attendees:
+            if person.has_nominee() and person.roommate_nominee_obj is not None:
+                self.nominators.setdefault(id(person.roommate_nominee_obj), []).append(person)
+        self.terms = {
+            "roomless": len(list(filter(lambda p: not p.has_room() and p.needs_room(), event.attendees))),
+            "overfull": len(list(filter(lambda r: r.overfull(), event.rooms))),
+            "nominee_failed": sum(map(self.nominee_failed, event.attendees)),
+            "imbalance": self.imbalance(self.total, self.total_squares),
+            "empty_rooms": occupancy.count(0),
+        }
+        self.score = self.weigh(self.terms)
+
+    def imbalance(self, total: int, total_squares: int):
+        # The standard deviation of occupancy, from its running sum and sum of squares
+        if not self.n_rooms:
+            return 0.
+        mean = total / self.n_rooms
+        return math.sqrt(max(total_squares / self.n_rooms - mean * mean, 0.))
+
+    def weigh(self, terms: dict):
+        return sum(map(lambda term: self.weights[term] * terms[term], self.weights))
+
+    @staticmethod
+    def nominee_failed(person: 'Attendee', destinations: dict = None):
+        """
+        Whether someone who has nominated a roommate is not sharing with them, once the people in destinations have
+        moved.
+        :param person: The Attendee.
+        :param destinations: dict of id(Attendee) to the Room (or None) that each person moving would join.
+        """
+        if not person.has_nominee():
+            return False
+        if destinations is None:
+            destinations = {}
+        room = destinations.get(id(person), person.room)
+        nominee = person.roommate_nominee_obj
+        if room is None or nominee is None:
+            return True
+        if id(nominee) in destinations:
+            return destinations[id(nominee)] is not room
+        # Anyone not moving stays in the rooms they are listed in
+        return not any(map(lambda o: o is nominee, room.roommates))
+
+    def delta(self, move: list):
+        """
+        Works out the change in score from a move, without making it.
+        :param move: list of (Attendee, Room left or None, Room joined or None).
+        :return: tuple of (change in score, the new state to pass to apply()).
+        """
+        destinations = dict(map(lambda m: (id(m[0]), m[2]), move))
+        changes = {}
+        for person, old, new in move:
+            for room, change in ((old, -1), (new, 1)):
+                if room is not None:
+                    if id(room) not in changes:
+                        changes[id(room)] = [room, 0]
+                    changes[id(room)][1] += change
+
+        terms = self.terms.copy()
+        total = self.total
+        total_squares = self.total_squares
+        for room, change in changes.values():
+            n = room.n_roommates()
+            m = n + change
+            total += change
+            total_squares += m * m - n * n
+            terms["empty_rooms"] += (m == 0) - (n == 0)
+            terms["overfull"] += (m > room.n_max) - (n > room.n_max)
+        terms["imbalance"] = self.imbalance(total, total_squares)
+
+        affected = {}
+        for person, old, new in move:
+            if person.needs_room():
+                terms["roomless"] += (new is None) - (old is None)
+            affected[id(person)] = person
+            for nominator in self.nominators.get(id(person), []):
+                affected[id(nominator)] = nominator
+        for person in affected.values():
+            terms["nominee_failed"] += self.nominee_failed(person, destinations) - self.nominee_failed(person)
+
+        return self.weigh(terms) - self.score, (terms, total, total_squares)
+
+    def apply(self, move: list, state: tuple):
+        """
+        Makes a move, taking everyone out of the rooms they leave before putting them in the rooms they join.
+        :param move: list of (Attendee, Room left or None, Room joined or None).
+        :param state: The state returned by delta() for this move.
+        """
+        for person, old, new in move:
+            if old is not None:
+                old.remove_roommate(person)
+        for person, old, new in move:
+            if new is not None:
+                new.add_roommate(person, override_suitable=True)
+        self.terms, self.total, self.total_squares = state
+        self.score = self.weigh(self.terms)
+
+
+def improve(
+        event: 'hwsa.event.Event',
+        max_iterations: int = 100000,
+        time_budget: float = None,
+        seed: int = 0,
+        temperature: float = 0.,
+        pack: bool = False
+):
+    """
+    Improves a finished allocation by moving people into rooms with space, swapping pairs of people between rooms and
+    moving people together with their nominee, keeping each change that lowers the score from
+    hwsa.multistart.score_allocation(). Half of the moves tried are for people who are roomless or not with their
+    nominee, and these are mostly tried with their nominee's room.
+    Nobody is put in a room with anyone they may not share with (by hwsa.event.may_share()), or in a room that isn't
+    accessible if they need one, and rooms assigned by hand (in rooms_manual) are left alone.
+    :param event: The Event, after allocation.
+    :param max_iterations: Number of moves to try.
+    :param time_budget: Wall time in seconds after which to stop, if sooner.
+    :param seed: Seed for choosing moves; the same seed and max_iterations (without a time budget) always give the same
+        result.
+    :param temperature: Starting temperature for simulated annealing, in units of score, cooling to zero by the end.
+        Worse moves are accepted with probability exp(-change / temperature), and the best allocation seen is kept. With
+        0, only improvements are kept (hill climbing).
+    :param pack: If True, score with pack_weights instead, so that rooms are emptied rather than evened out.
+    :return: dict of the number of "iterations" and of moves "accepted", the "initial" and "final" score terms, and the
+        "rooms" whose occupants changed.
+    """
+    from hwsa.event import may_share
+
+    start = time.perf_counter()
+    rng = random.Random(seed)
+    score = AllocationScore(event, weights=pack_weights if pack else score_weights)
+    initial = dict(score.terms, score=score.score)
+
+    # People listed in more than one room are left where they are, as are rooms assigned by hand
+    fixed = set(map(id, filter(lambda r: event.manual_override("rooms", r.filename()) is not None, event.rooms)))
+    listings = {}
+    for room in event.rooms:
+        for person in room.roommates:
+            listings[id(person)] = listings.get(id(person), 0) + 1
+    rooms = list(filter(lambda r: id(r) not in fixed, event.rooms))
+    people = list(filter(
+        lambda p: id(p.room) not in fixed and listings.get(id(p)) == 1 if p.has_room() else p.needs_room(),
+        event.attendees
+    ))
+    movable = set(map(id, people))
+
+    def fits(person, room, leaving):
+        # Whether person could join room once leaving (if anyone) has left it; nobody who needs an accessible room is
+        # moved out of one
+        if person.needs_accessible_room() and not room.is_accessible():
+            return False
+        return all(map(
+            lambda o: o is leaving or may_share(person, o),
+            room.roommates
+        ))
+
+    def propose(person):
+        old = person.room
+        nominee = person.roommate_nominee_obj if person.has_nominee() else None
+        apart = nominee is not None and nominee is not person and (old is None or nominee.room is not old)
+        if apart and id(nominee) in movable and rng.random() < 0.3:
+            # Move the person and their nominee into a room together
+            room = rng.choice(rooms)
+            if room is old or room is nominee.room or room.n_max - room.n_roommates() < 2 \
+                    or not fits(person, room, None) or not fits(nominee, room, None) \
+                    or not may_share(person, nominee):
+                return None
+            return [(person, old, room), (nominee, nominee.room, room)]
+        if apart and nominee.room is not None and id(nominee.room) not in fixed and rng.random() < 0.7:
+            room = nominee.room
+        else:
+            room = rng.choice(rooms)
+        if room is old:
+            return None
+        if not room.full():
+            return [(person, old, room)] if fits(person, room, None) else None
+        others = list(filter(lambda o: o is not nominee and id(o) in movable, room.roommates))
+        if not others:
+            return None
+        other = rng.choice(others)
+        if not fits(person, room, other) or (old is not None and not fits(other, old, person)):
+            return None
+        return [(person, old, room), (other, room, old)]
+
+    def unhappy():
+        return list(filter(
+            lambda p: not p.has_room() or score.nominee_failed(p),
+            people
+        ))
+
+    before = dict(map(lambda r: (id(r), list(r.roommates)), event.rooms))
+    iterations = 0
+    accepted = 0
+    best = score.score
+    # Moves made since the best allocation seen, to be undone at the end if annealing has made things worse
+    since_best = []
+    focus = []
+    while people and rooms and iterations < max_iterations:
+        elapsed = time.perf_counter() - start
+        if time_budget is not None and elapsed > time_budget:
+            break
+        if iterations % len(people) == 0:
+            focus = unhappy()
+        iterations += 1
+        person = rng.choice(focus) if focus and rng.random() < 0.5 else rng.choice(people)
+        move = propose(person)
+        if move is None:
+            continue
+        change, state = score.delta(move)
+        if change >= 0:
+            if temperature <= 0:
+                continue
+            progress = iterations / max_iterations
+            if time_budget:
+                progress = max(progress, elapsed / time_budget)
+            current = temperature * (1. - progress)
+            if current <= 0 or rng.random() >= math.exp(-change / current):
+                continue
+        score.apply(move, state)
+        accepted += 1
+        since_best.append(move)
+        if score.score < best:
+            best = score.score
+            since_best = []
+
+    for move in reversed(since_best):
+        undo = list(map(lambda m: (m[0], m[2], m[1]), move))
+        score.apply(undo, score.delta(undo)[1])
+
+    final = dict(score.terms, score=score.score)
+    log.debug("Local search: %s of %s moves accepted, score %s to %s", accepted, iterations, initial, final)
+    return {
+        "iterations": iterations,
+        "accepted": accepted,
+        "initial": initial,
+        "final": final,
+        "rooms": list(filter(lambda r: r.roommates != before[id(r)], event.rooms)),
+    }
@@ -0,0 +1,152 @@
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import os
+import pickle
+import random
+import time
+
+import numpy as np
+
+import hwsa.utils as u
+
+log = u.get_logger("allocation")
+
+# Weight of each term of an allocation's score, where lower scores are better. Each term outweighs any likely total of
+# those after it: anyone left without a room (or a room over capacity) is worst, then a nominated roommate not shared
+# with, then uneven occupancy (the standard deviation of the number of people per room), then rooms left empty.
+score_weights = {
+    "roomless": 1e6,
+    "overfull": 1e6,
+    "nominee_failed": 1e3,
+    "imbalance": 1e2,
+    "empty_rooms": 1.,
+}
+
+# The pickled event each worker process starts every variant from; see _init_worker().
+_snapshot = None
+
+
+def score_allocation(event: 'hwsa.event.Event'):
+    """
+    Scores an event's allocation by the terms in score_weights.
+    :param event: The Event, after allocation.
+    :return: dict of each term and the weighted "score"; lower is better.
+    """
+    occupancy = np.array(list(map(lambda r: r.n_roommates(), event.rooms)))
+    terms = {
+        "roomless": len(list(filter(lambda p: not p.has_room() and p.needs_room(), event.attendees))),
+        "overfull": len(list(filter(lambda r: r.overfull(), event.rooms))),
+        "nominee_failed": len(list(filter(
+            lambda p: p.has_nominee() and p.roommate_nominee_obj not in p.roommates(),
+            event.attendees
+        ))),
+        "imbalance": float(occupancy.std()) if len(occupancy) else 0.,
+        "empty_rooms": int(np.sum(occupancy == 0)),
+    }
+    terms["score"] = sum(map(lambda term: score_weights[term] * terms[term], score_weights))
+    return terms
+
+
+def start_seeds(seed: int, n_starts: int):
+    """
+    The seed of each start, derived from one seed so that a search can be repeated. The first start is always 0,
+    which keeps the existing order.
+    """
+    rng = random.Random(seed)
+    return [0] + list(map(lambda _: rng.randrange(1, 2 ** 32), range(n_starts - 1)))
+
+
+def run_start(snapshot: bytes, start_seed: int):
+    """
+    Runs the greedy passes on a copy of the event with its nominators and attendees shuffled, which changes the order
+    in which people are placed (ties in get_roomless()'s sort and the gender rotation in assign_by_gender() both follow
+    it).
+    :param snapshot: The pickled Event, before allocation.
+    :param start_seed: Seed for the shuffle; 0 leaves the order unchanged.
+    :return: tuple of (score terms from score_allocation(), list of the attendee indices in each room in room_order,
+        list of the room_order position of each attendee's room or None); attendee indices are into the unshuffled
+        event.attendees.
+    """
+    event = pickle.loads(snapshot)
+    index = dict(map(lambda item: (id(item[1]), item[0]), enumerate(event.attendees)))
+    people = list(event.attendees)
+    rng = random.Random(start_seed) if start_seed else None
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        event.assign_nominated(rng=rng)
+        # Nominees have been matched by now, which also depends on the order of the attendees
+        if rng is not None:
+            rng.shuffle(event.attendees)
+        event.assign_accessible()
+        event.assign_by_gender()
+        event.assign_by_preference()
+    positions = dict(map(lambda item: (id(item[1]), item[0]), enumerate(event.room_order)))
+    occupants = list(map(lambda r: list(map(lambda p: index[id(p)], r.roommates)), event.room_order))
+    rooms = list(map(lambda p: positions[id(p.room)] if p.room is not None else None, people))
+    return score_allocation(event), occupants, rooms
+
+
+def _init_worker(snapshot: bytes):
+    global _snapshot
+    _snapshot = snapshot
+
+
+def _run_start(start_seed: int):
+    return start_seed, run_start(_snapshot, start_seed)
+
+
+def search(
+        event: 'hwsa.event.Event',
+        n_starts: int = 32,
+        seed: int = 0,
+        time_budget: float = None,
+        n_processes: int = 1
+):
+    """
+    Runs the greedy passes many times over on differently shuffled copies of the event, and keeps the best-scoring
+    result. The event itself is left as it is.
+    The same seed and n_starts always give the same result. With a time budget, no new starts are begun once it has
+    run out, so the number completed depends on the machine; the winning start's seed is returned so that it can be
+    repeated.
+    :param event: The Event, before allocation.
+    :param n_starts: Maximum number of starts.
+    :param seed: Seed from which each start's seed is derived; see start_seeds().
+    :param time_budget: Wall time in seconds after which no more starts are begun; if None, all n_starts are run.
+    :param n_processes: Number of worker processes to run starts in.
+    :return: dict with the best start's "seed", "terms" (from score_allocation()), "occupants" and "rooms" (as returned
+        by run_start()), and the number of "starts" completed.
+    """
+    snapshot = pickle.dumps(event, protocol=pickle.HIGHEST_PROTOCOL)
+    seeds = start_seeds(seed, n_starts)
+    start = time.perf_counter()
+
+    def out_of_time():
+        return time_budget is not None and time.perf_counter() - start > time_budget
+
+    results = []
+    if n_processes > 1:
+        with ProcessPoolExecutor(max_workers=n_processes, initializer=_init_worker, initargs=(snapshot,)) as executor:
+            # Only keep a couple of starts queued per worker, so that the time budget is checked as they finish
+            pending = []
+            seeds_left = list(seeds)
+            while seeds_left or pending:
+                while seeds_left and len(pending) < 2 * n_processes and not out_of_time():
+                    pending.append(executor.submit(_run_start, seeds_left.pop(0)))
+                if not pending:
+                    break
+                results.append(pending.pop(0).result())
+                if out_of_time():
+                    # Starts still queued are dropped; those already running are waited for
+                    seeds_left = []
+                    pending = list(filter(lambda future: not future.cancel(), pending))
+    else:
+        _init_worker(snapshot)
+        for start_seed in seeds:
+            results.append(_run_start(start_seed))
+            if out_of_time():
+                break
+
+    # Ties go to the earliest start, so that the result is the same however the starts were spread over workers
+    order = dict(map(lambda item: (item[1], item[0]), enumerate(seeds)))
+    best_seed, (terms, occupants, rooms) = min(results, key=lambda r: (r[1][0]["score"], order[r[0]]))
+    log.debug("Best of %s starts: seed %s, %s", len(results), best_seed, terms)
+    return {"seed": best_seed, "terms": terms, "occupants": occupants, "rooms": rooms, "starts": len(results)}
@@ -1,37 +1,55 @@
-import os
+import csv
+import logging
 
 from hwsa.attendee import Attendee
-from hwsa.utils import debug_print, load_params
+from hwsa.utils import get_logger, load_params, SlotRecord
 
+log = get_logger("room")
+
+# Other names accepted for Room fields in a room inventory (see load_inventory()).
+inventory_aliases = {
+    "capacity": "n_max",
+    "type": "room_type",
+}
+
+
+class Room(SlotRecord):
+    fields = (
+        "roommates",
+        "n_max",
+        "id",
+        "event",
+        "room_type",
+        "accessible",
+        "cost",
+    )
+    __slots__ = fields
 
-class Room:
     def __init__(self, **kwargs):
+        self.extra = None
         self.roommates = []
         self.n_max = 2
         self.id = None
         self.event = None
-        for key, value in kwargs.items():
-            setattr(self, key, value)
+        self.update_fields(kwargs)
 
     def __str__(self):
         return f"Room {self.id}"
 
-    def __hash__(self):
-        return hash(str(self))
-
     def update_manual(self):
-        debug_print(f"Attempting manual update for {self}...")
+        log.debug("Attempting manual update for %s...", self)
 
         if self.event is not None:
-            manual_path = os.path.join(self.event.output, "rooms_manual", self.filename() + ".yaml")
-            debug_print("\t", manual_path)
-            if os.path.isfile(manual_path):
-                yml = load_params(manual_path)
+            yml = self.event.manual_override("rooms", self.filename())
+            if yml is not None:
                 print(f"Manually setting roommates for {self}:")
                 roommates = yml.pop("roommates")
                 if "event" in yml:
                     yml.pop("event")
-                self.__dict__.update(yml)
+                n_max = self.n_max
+                self.update_fields(yml)
+                # The override can change the capacity or accessibility, which the event's room indices are keyed on
+                self.event.reindex_room(self, n_max)
                 for p_id in roommates:
                     if p_id in self.event.attendees_dict:
                         p = self.event.attendees_dict[p_id]
@@ -51,22 +69,55 @@ class Room:
         )
 
     def add_roommate(self, person: 'Attendee', override_suitable=False):
+        # This runs for every placement, so the checks are only repeated for the debug output if it will be shown
+        trace = log.isEnabledFor(logging.DEBUG)
+        if self.event is not None:
+            self.event.count("placements_attempted")
         # Check if the room is already full
-        debug_print(f"\t Checking {self}")
-        debug_print(f"\t\tChecking room capacity: {self.n_roommates()} / {self.n_max}", not self.full())
+        if trace:
+            log.debug("\t Checking %s", self)
+            log.debug("\t\tChecking room capacity: %s / %s %s", self.n_roommates(), self.n_max, not self.full())
         if not self.full():
             # Check if it's a real person (None or nan will get passed here sometimes, and we don't want those piling up)
-            debug_print("\t\tChecking if real person:", isinstance(person, Attendee))
+            if trace:
+                log.debug("\t\tChecking if real person: %s", isinstance(person, Attendee))
             if isinstance(person, Attendee):
                 # Check if room is compatible with person's preferences:
-                debug_print("\t\tChecking if room is suitable:", self.suitable_for(person))
+                if trace:
+                    log.debug("\t\tChecking if room is suitable: %s", self.suitable_for(person))
                 if override_suitable or self.suitable_for(person):
                     person.room = self
                     # Check for duplicates and add the person to this list if not present
-                    debug_print("\t\tChecking that person is not already in this room:", person not in self.roommates)
+                    if trace:
+                        log.debug(
+                            "\t\tChecking that person is not already in this room: %s",
+                            person not in self.roommates
+                        )
                     if person not in self.roommates:
                         self.roommates.append(person)
-                        debug_print(f"\tAdding {person.room_str()} to {self} ({self.single_gender()})")
+                        if self.event is not None:
+                            self.event.count("placements")
+                            self.event.update_room_index(self)
+                        if trace:
+                            log.debug("\tAdding %s to %s (%s)", person.room_str(), self, self.single_gender())
+
+    def remove_roommate(self, person: 'Attendee'):
+        if person in self.roommates:
+            self.roommates.remove(person)
+            if person.room is self:
+                person.room = None
+            if self.event is not None:
+                self.event.update_room_index(self)
+
+    def is_accessible(self):
+        # room_type, accessible and cost are only set for rooms from an inventory, and are otherwise left out of outputs
+        return bool(getattr(self, "accessible", False))
+
+    def cost_per_bed(self):
+        cost = getattr(self, "cost", None)
+        if not isinstance(cost, (int, float)) or cost != cost or not self.n_max:
+            return 0.
+        return cost / self.n_max
 
     def n_roommates(self):
         return len(self.roommates)
@@ -94,15 +145,34 @@ class Room:
         return gender
 
     def suitable_for(self, person: 'Attendee'):
+        trace = log.isEnabledFor(logging.DEBUG)
+        if self.event is not None:
+            self.event.count("compatibility_checks", len(self.roommates))
         for roommate in self.roommates:
-            debug_print(f"\t\t\t Checking compatibility with {roommate.room_str()}:",
-                        compatible_roommates(person, roommate))
-            if not compatible_roommates(person, roommate):
+            compatible = compatible_roommates(person, roommate)
+            if trace:
+                log.debug("\t\t\t Checking compatibility with %s: %s", roommate.room_str(), compatible)
+            if not compatible:
                 return False
         return True
 
+    def composition(self):
+        """
+        Summarises the occupants for the event's room indices, using the gender codes from Event.encode_attendee().
+        :return: tuple of (bitmask of the genders present, bitmask of the genders every occupant is comfortable
+            sharing with)
+        """
+        genders = 0
+        accepts = -1
+        for person in self.roommates:
+            if person.gender_code is None:
+                self.event.encode_attendee(person)
+            genders |= 1 << person.gender_code
+            accepts &= person.preference_mask
+        return genders, accepts
+
     def to_yaml(self):
-        a_dict = self.__dict__.copy()
+        a_dict = self.to_dict()
         for key, value in a_dict.items():
             if not isinstance(value, (float, int, str)):
                 value = str(value)
@@ -115,5 +185,91 @@ class Room:
 
 
 def compatible_roommates(person_1: 'Attendee', person_2: 'Attendee'):
-    return person_1 is not person_2 and person_1.prefer_roommate(person_2) and person_2.prefer_roommate(
-        person_1)
+    if person_1 is person_2:
+        return False
+    event = person_1.event
+    if event is not None and person_2.event is event and None not in (
+            person_1.compatibility_type, person_2.compatibility_type):
+        return event.compatibility_lookup()[person_1.compatibility_type][person_2.compatibility_type]
+    return person_1.prefer_roommate(person_2) and person_2.prefer_roommate(person_1)
+
+
+def composition_suitable_for(composition: tuple, person: 'Attendee'):
+    """
+    Equivalent to Room.suitable_for(), but works from Room.composition() so that rooms with the same mix of occupants
+    can be checked all at once.
+    """
+    genders, accepts = composition
+    if person.gender_code is None:
+        person.event.encode_attendee(person)
+    return genders & ~person.preference_mask == 0 and bool(accepts >> person.gender_code & 1)
+
+
+def _inventory_value(key: str, value):
+    if isinstance(value, str):
+        value = value.strip()
+        if key == "accessible":
+            return value.lower() in ("y", "yes", "true", "1")
+        if key in ("n_max", "cost") and value:
+            return float(value) if key == "cost" else int(value)
+        if not value:
+            return None
+    return value
+
+
+def _inventory_id_key(room_id):
+    # Ids that would give the same room filename (or, for numbers, the same number) are the same room
+    key = str(room_id).strip().casefold().replace(" ", "_")
+    if key.isdigit():
+        key = str(int(key))
+    return key
+
+
+def load_inventory(path: str):
+    """
+    Reads a room inventory, giving each room's id and, optionally, its capacity, type, whether it is accessible and its
+    cost. The inventory is either a CSV with a header row, eg
+
+        id,capacity,type,accessible,cost
+        79,2,Motel budget AC Unit,no,95
+        25,3,Motel AC Unit,yes,140
+
+    or a YAML file mapping each room's id to the same attributes.
+    Room ids are all ints if every id is a plain number, as the built-in room numbers are, and are otherwise all
+    strings, so that rooms can always be sorted by id. Ids that differ only in case, spacing or leading zeros are
+    rejected, since they would be written to the same files.
+    :param path: Path to the inventory.
+    :return: list of dicts of Room fields, in the order given.
+    """
+    if path.endswith(".csv"):
+        with open(path, newline="") as file:
+            entries = list(csv.DictReader(file))
+    else:
+        entries = list(map(
+            lambda item: dict(item[1] or {}, id=item[0]),
+            (load_params(path) or {}).items()
+        ))
+    rooms = []
+    ids = {}
+    for entry in entries:
+        room = {}
+        for key, value in entry.items():
+            key = key.strip().lower()
+            key = inventory_aliases.get(key, key)
+            value = _inventory_value(key, value)
+            if value is not None:
+                room[key] = value
+        if "id" not in room:
+            raise ValueError(f"Room inventory {path} has a room with no id.")
+        room["id"] = str(room["id"]).strip()
+        key = _inventory_id_key(room["id"])
+        if key in ids:
+            raise ValueError(
+                f"Room inventory {path} lists room {room['id']} more than once (as {ids[key]!r} and {room['id']!r})."
+            )
+        ids[key] = room["id"]
+        rooms.append(room)
+    if all(map(lambda r: r["id"].isdigit() and r["id"] == str(int(r["id"])), rooms)):
+        for room in rooms:
+            room["id"] = int(room["id"])
+    return rooms
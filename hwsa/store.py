@@ -0,0 +1,125 @@
+import json
+import os
+import sqlite3
+
+import hwsa.utils as u
+
+# File extension for each store format.
+store_extensions = {
+    "jsonl": ".jsonl",
+    "sqlite": ".sqlite",
+}
+
+
+def store_records(rooms: list, attendees: list):
+    """
+    Flattens rooms and attendees into records for an output store.
+    Each record holds the entity's kind ("room" or "attendee"), the file name it would have in the YAML tree, and the
+    same dict that would be written there.
+    :param rooms: list of Rooms.
+    :param attendees: list of Attendees.
+    :return: list of record dicts.
+    """
+    records = []
+    for kind, entities in (("room", rooms), ("attendee", attendees)):
+        for entity in entities:
+            records.append({"kind": kind, "filename": entity.filename(), "data": entity.to_yaml()})
+    return records
+
+
+def _dumps(record: dict):
+    # NaN (for empty cells) is written as JSON's non-standard NaN, which json.loads() reads back.
+    return json.dumps(record, default=str)
+
+
+def write_jsonl(path: str, records: list):
+    """
+    Writes records as JSON lines, all in one write.
+    """
+    lines = list(map(_dumps, records))
+    with open(path, "w") as file:
+        file.write("\n".join(lines) + "\n")
+
+
+def read_jsonl(path: str):
+    with open(path) as file:
+        return list(map(json.loads, filter(None, map(str.strip, file))))
+
+
+def write_sqlite(path: str, records: list):
+    """
+    Writes records to a SQLite database, replacing any earlier output, with one table each for rooms and attendees.
+    Each row holds the file name and the record's data as JSON, which SQLite's json_extract() can query.
+    """
+    if os.path.isfile(path):
+        os.remove(path)
+    connection = sqlite3.connect(path)
+    try:
+        with connection:
+            for kind in ("room", "attendee"):
+                connection.execute(f"CREATE TABLE {kind}s (filename TEXT PRIMARY KEY, data TEXT NOT NULL)")
+                connection.executemany(
+                    f"INSERT INTO {kind}s VALUES (?, ?)",
+                    map(
+                        lambda r: (r["filename"], _dumps(r["data"])),
+                        filter(lambda r: r["kind"] == kind, records)
+                    )
+                )
+    finally:
+        connection.close()
+
+
+def read_sqlite(path: str):
+    connection = sqlite3.connect(path)
+    try:
+        records = []
+        for kind in ("room", "attendee"):
+            for filename, data in connection.execute(f"SELECT filename, data FROM {kind}s ORDER BY rowid"):
+                records.append({"kind": kind, "filename": filename, "data": json.loads(data)})
+    finally:
+        connection.close()
+    return records
+
+
+def write_store(path: str, records: list):
+    """
+    Writes records to a JSON-lines file or SQLite database, depending on the extension of path.
+    """
+    if path.endswith(store_extensions["sqlite"]):
+        write_sqlite(path, records)
+    else:
+        write_jsonl(path, records)
+
+
+def read_store(path: str):
+    """
+    Reads back the records written by write_store().
+    """
+    if path.endswith(store_extensions["sqlite"]):
+        return read_sqlite(path)
+    return read_jsonl(path)
+
+
+def write_yaml_tree(store_path: str, output: str):
+    """
+    Generates the per-entity YAML files (output/rooms/*.yaml and output/attendees/*.yaml) from a store.
+    :param store_path: Path to a store written by write_store().
+    :param output: Directory to write the tree under.
+    """
+    write_yaml_records(records=read_store(store_path), output=output)
+
+
+def yaml_tree_dirs(output: str):
+    return {"room": os.path.join(output, "rooms"), "attendee": os.path.join(output, "attendees")}
+
+
+def write_yaml_records(records: list, output: str):
+    """
+    Writes the YAML file in the per-entity tree for each of the given records, leaving the rest of the tree alone.
+    :param records: list of records, from store_records() or read_store().
+    :param output: Directory the tree is under.
+    """
+    dirs = yaml_tree_dirs(output)
+    u.mkdir_check(*dirs.values())
+    for record in records:
+        u.save_params(os.path.join(dirs[record["kind"]], record["filename"]), record["data"])
@@ -0,0 +1,270 @@
+import datetime
+import random
+
+import hwsa.ingest as ingest
+
+default_gender_mix = {
+    "Man": 0.45,
+    "Woman": 0.45,
+    "Non-binary": 0.1,
+}
+
+# How people fill in the 'comfortable sharing with' question:
+#   own: only their own gender; own_and_other: their own and one other; any: every gender;
+#   no_preference: the 'No preference' option; other_only: a gender other than their own; blank: nothing.
+default_preference_mix = {
+    "own": 0.4,
+    "own_and_other": 0.2,
+    "any": 0.15,
+    "no_preference": 0.1,
+    "other_only": 0.05,
+    "blank": 0.1,
+}
+
+will_nominate_options = {
+    "now": "Nominate a roommate",
+    "later": "Will nominate someone later",
+    "no": "No roommate nomination. Please allocate one to me.",
+}
+
+syllables = [
+    "ka", "lo", "mi", "ra", "ten", "son", "ber", "ly", "an", "dre", "wi", "chu", "no", "vak", "el", "ta", "jo", "ri",
+    "sa", "mon", "de", "li", "ha", "ru", "ne", "zo", "bi", "gan", "pe", "tor",
+]
+titles = ["Mr", "Ms", "Mx", "Dr", "Prof", None]
+diets = [None, "No specific requirements", "Vegetarian", "Vegan", "Gluten free", "Halal", "Kosher"]
+career_stages = ["Honours", "Masters", "PhD (1st year)", "PhD (2nd year)", "PhD (3rd year+)", "Postdoc", "Other"]
+research_techniques = ["Observation", "Simulation", "Theory", "Instrumentation", "Machine learning"]
+affiliations = [
+    "Australian National University", "Curtin University", "Macquarie University", "Monash University",
+    "Swinburne University of Technology", "The University of Sydney", "University of Melbourne",
+    "University of New South Wales", "University of Queensland", "University of Western Australia",
+    "ICRAR/UWA", "CSIRO",
+]
+accessibility = [None] * 18 + ["Wheelchair access", "Ground floor room"]
+
+
+def mq_columns(genders: list):
+    """
+    The header row of a synthetic Macquarie export, with the columns that Attendee.from_mq_xl_row() expects.
+    There is one roommate-preference column for each gender, and one for 'No preference'.
+    :param genders: list of gender options.
+    :return: list of column names, in order.
+    """
+    names = list(ingest.mq_fields.values())
+    names += [ingest.career_str, ingest.career_other_str]
+    names += [ingest.room_str] * (len(genders) + 1)
+    names += [ingest.research_str] * len(research_techniques)
+    names += [ingest.research_other_str, "LOC"]
+    return names
+
+
+def _weighted(rng: random.Random, mix: dict):
+    return rng.choices(list(mix.keys()), weights=list(mix.values()))[0]
+
+
+def _make_name(rng: random.Random, n_syllables: int):
+    name = "".join(rng.choice(syllables) for _ in range(n_syllables)).capitalize()
+    # Some syllables spell out strings that are read back as empty cells, eg "None"
+    while name in ingest.na_values:
+        name = "".join(rng.choice(syllables) for _ in range(n_syllables)).capitalize()
+    return name
+
+
+def typo(rng: random.Random, name: str):
+    """
+    Mangles a name the way people mistype their nominee's: a dropped or swapped letter, the wrong case, the given name
+    only, or stray whitespace.
+    """
+    kind = rng.choice(["drop", "swap", "case", "given", "space"])
+    if kind == "drop" and len(name) > 3:
+        i = rng.randrange(1, len(name) - 1)
+        return name[:i] + name[i + 1:]
+    if kind == "swap" and len(name) > 3:
+        i = rng.randrange(1, len(name) - 2)
+        return name[:i] + name[i + 1] + name[i] + name[i + 2:]
+    if kind == "case":
+        return name.lower()
+    if kind == "given":
+        return name.split(" ")[0]
+    return " " + name.replace(" ", "  ") + " "
+
+
+def _preferences(rng: random.Random, gender: str, genders: list, preference_mix: dict):
+    kind = _weighted(rng, preference_mix)
+    others = list(filter(lambda g: g != gender, genders))
+    if kind == "own":
+        return [gender], False
+    if kind == "own_and_other":
+        return [gender, rng.choice(others)], False
+    if kind == "any":
+        return list(genders), False
+    if kind == "no_preference":
+        return [], True
+    if kind == "other_only":
+        return [rng.choice(others)], False
+    return [], False
+
+
+def generate_registrations(
+        n: int,
+        seed: int = 0,
+        gender_mix: dict = None,
+        preference_mix: dict = None,
+        nominate_fraction: float = 0.4,
+        mutual_fraction: float = 0.6,
+        chain_fraction: float = 0.1,
+        typo_fraction: float = 0.1,
+        duplicate_fraction: float = 0.02,
+        accommodation_fraction: float = 0.9
+):
+    """
+    Generates synthetic registrations laid out as in a Macquarie export.
+    :param n: Number of distinct people; duplicates are added on top.
+    :param seed: Random seed; the same arguments and seed always give the same registrations.
+    :param gender_mix: dict of gender to relative frequency; defaults to default_gender_mix.
+    :param preference_mix: dict of roommate-preference kind to relative frequency; see default_preference_mix.
+    :param nominate_fraction: Fraction of people who nominate a roommate.
+    :param mutual_fraction: Fraction of nominators whose nominee nominates them back.
+    :param chain_fraction: Fraction of nominators who are part of a chain (A nominates B, who nominates C, ...).
+    :param typo_fraction: Fraction of nominations with a mistyped name.
+    :param duplicate_fraction: Fraction of people who register twice; half of the repeats use a different email.
+    :param accommodation_fraction: Fraction of people registering for accommodation.
+    :return: tuple of (column names, rows), with each row a list in the order of the column names.
+    """
+    rng = random.Random(seed)
+    if gender_mix is None:
+        gender_mix = default_gender_mix
+    if preference_mix is None:
+        preference_mix = default_preference_mix
+    genders = list(gender_mix.keys())
+    names = mq_columns(genders)
+    column = dict(map(lambda item: (item[1], item[0]), reversed(list(enumerate(names)))))
+    room_columns = list(filter(lambda i: names[i] == ingest.room_str, range(len(names))))
+    research_columns = list(filter(lambda i: names[i] == ingest.research_str, range(len(names))))
+
+    # Enough family names to give realistic clashes, without almost everyone sharing one
+    family_names = list(map(lambda _: _make_name(rng, rng.choice([2, 3])), range(max(20, n // 4))))
+    given_names = list(map(lambda _: _make_name(rng, 2), range(max(20, n // 10))))
+
+    people = []
+    for i in range(n):
+        gender = _weighted(rng, gender_mix)
+        preferences, no_preference = _preferences(rng, gender, genders, preference_mix)
+        given = rng.choice(given_names)
+        family = rng.choice(family_names)
+        row = [None] * len(names)
+        values = {
+            "ID": 100000 + i,
+            "Title": rng.choice(titles),
+            "First Name": given,
+            "Last Name": family,
+            "Mobile Number": "04" + str(rng.randrange(10 ** 8)).zfill(8),
+            "Primary Email": f"{given}.{family}{i}@example.edu".lower(),
+            "Dietary Requirements": rng.choice(diets),
+            "Marketing - Gender Identity": gender,
+            "Marketing - Primary Affiliation": rng.choice(affiliations),
+            "Marketing - Your Research/Thesis Topic": "Synthetic topic " + str(rng.randrange(50)),
+            "Registration Type - Name": (
+                "Attendance & Accommodation" if rng.random() < accommodation_fraction else "Attendance only"
+            ),
+            "Amount Outstanding": rng.choice([0., 0., 0., 150.]),
+            "Amount Required": 450.,
+            "Date Registered": datetime.datetime(2023, 5, 1) + datetime.timedelta(minutes=rng.randrange(60 * 24 * 60)),
+            "Marketing - Accessibility": rng.choice(accessibility),
+            ingest.career_str: rng.choice(career_stages),
+            "LOC": "Y" if rng.random() < 0.02 else None,
+        }
+        for key, value in values.items():
+            row[column[key]] = value
+        for j, option in zip(room_columns, genders):
+            if option in preferences:
+                row[j] = option
+        if no_preference:
+            row[room_columns[-1]] = "No preference"
+        for j, technique in zip(research_columns, research_techniques):
+            if rng.random() < 0.3:
+                row[j] = technique
+        people.append(row)
+
+    # Nominations: mutual pairs, one-way nominations and chains
+    def full_name(row: list):
+        return f"{row[column['First Name']]} {row[column['Last Name']]}"
+
+    def nominate(row: list, nominee: list):
+        name = full_name(nominee)
+        if rng.random() < typo_fraction:
+            name = typo(rng, name)
+        row[column["Marketing - Nominated roommate"]] = name
+        row[column["Marketing - Would you like to nominate a roommate?"]] = will_nominate_options["now"]
+
+    order = list(range(n))
+    rng.shuffle(order)
+    nominators = order[:int(n * nominate_fraction)]
+    k = 0
+    while k < len(nominators) - 1:
+        if rng.random() < chain_fraction and k < len(nominators) - 2:
+            a, b, c = map(lambda j: people[nominators[j]], (k, k + 1, k + 2))
+            nominate(a, b)
+            nominate(b, c)
+            nominate(c, a)
+            k += 3
+            continue
+        a, b = people[nominators[k]], people[nominators[k + 1]]
+        nominate(a, b)
+        if rng.random() < mutual_fraction:
+            nominate(b, a)
+        k += 2
+    for row in people:
+        if row[column["Marketing - Would you like to nominate a roommate?"]] is None:
+            row[column["Marketing - Would you like to nominate a roommate?"]] = rng.choice(
+                [will_nominate_options["later"], will_nominate_options["no"]]
+            )
+
+    # Duplicate registrations, with new IDs
+    rows = list(people)
+    for i in range(int(n * duplicate_fraction)):
+        row = list(rng.choice(people))
+        row[column["ID"]] = 100000 + n + i
+        if rng.random() < 0.5:
+            row[column["Primary Email"]] = f"other{i}@example.com"
+        rows.insert(rng.randrange(len(rows) + 1), row)
+
+    return names, rows
+
+
+def write_mq_xl(path: str, n: int, **kwargs):
+    """
+    Writes synthetic registrations to an XLSX laid out like a Macquarie export (a header row, then a row of
+    "Value - Value" placeholders), readable by Event.from_mq_xl().
+    :param path: Path to write to.
+    :param n: Number of distinct people.
+    :param kwargs: passed to generate_registrations().
+    :return: Path written to.
+    """
+    import openpyxl
+
+    names, rows = generate_registrations(n, **kwargs)
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(names)
+    sheet.append(["Value - Value"] * len(names))
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+    return path
+
+
+def registrations_frame(n: int, **kwargs):
+    """
+    Generates synthetic registrations as a DataFrame with the column names pandas gives a real export, so that its
+    rows can go straight to Attendee.from_mq_xl_row().
+    :param n: Number of distinct people.
+    :param kwargs: passed to generate_registrations().
+    :return: pandas.DataFrame
+    """
+    import numpy as np
+    import pandas as pd
+
+    names, rows = generate_registrations(n, **kwargs)
+    return pd.DataFrame(rows, columns=ingest._mangle_names(names)).fillna(np.nan)
@@ -1,12 +1,161 @@
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import logging
 import os
+import re
+import sys
+
 import astropy.io.misc.yaml as yaml
+import numpy as np
+
+# Debug output goes through a logger for each subsystem (hwsa.event, hwsa.room, ...) under this one, so that each can be
+# set to its own level; see set_debug().
+logger = logging.getLogger("hwsa")
+
+
+def get_logger(subsystem: str):
+    return logging.getLogger(f"hwsa.{subsystem}")
+
+
+log = get_logger("utils")
+
+
+class Lazy:
+    """
+    Defers a call until a log message that uses it is actually written, eg log.debug("%s", Lazy(person.room_str)), so
+    that building debug output costs nothing when debugging is off.
+    """
+    __slots__ = ("function", "args")
+
+    def __init__(self, function, *args):
+        self.function = function
+        self.args = args
+
+    def __str__(self):
+        return str(self.function(*self.args))
+
+
+def set_debug(enabled: bool = True, levels: dict = None):
+    """
+    Turns debug output (to stdout) on or off for all subsystems, then sets any per-subsystem levels.
+    :param enabled: Whether to show debug messages.
+    :param levels: dict of subsystem name (eg "room") to logging level (eg "DEBUG", "WARNING" or logging.INFO); these
+        override enabled for that subsystem.
+    """
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.propagate = False
+    if enabled:
+        logger.setLevel(logging.DEBUG)
+    else:
+        logger.setLevel(logging.WARNING)
+    if levels is not None:
+        for subsystem, level in levels.items():
+            if isinstance(level, str):
+                level = level.upper()
+            get_logger(subsystem).setLevel(level)
+
+
+@contextlib.contextmanager
+def redirect_logs(stream):
+    """
+    Sends the output of the hwsa loggers to stream for the duration of the block, then puts it back; set_debug() binds
+    them to whatever sys.stdout was at the time, so contextlib.redirect_stdout() alone doesn't catch them.
+    :param stream: File-like object to write to.
+    """
+    handlers = list(filter(lambda h: isinstance(h, logging.StreamHandler), logger.handlers))
+    added = None
+    if not handlers:
+        added = logging.StreamHandler(stream)
+        added.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(added)
+    previous = list(map(lambda h: h.stream, handlers))
+    for handler in handlers:
+        handler.setStream(stream)
+    try:
+        yield stream
+    finally:
+        for handler, old in zip(handlers, previous):
+            handler.setStream(old)
+        if added is not None:
+            logger.removeHandler(added)
+
+
+class SlotRecord:
+    """
+    Base for classes that keep their known attributes in __slots__ rather than a per-instance __dict__. Anything else
+    (eg unrecognised spreadsheet columns) goes in a single extra dict, which is only created when needed.
+    Subclasses list their known attributes in fields, and set __slots__ = fields.
+    """
+    __slots__ = ("extra",)
+    fields = ()
+
+    def __getattr__(self, item):
+        # Only called when normal lookup fails, ie for unset slots and for extra attributes
+        if item != "extra":
+            extra = self.extra
+            if extra is not None and item in extra:
+                return extra[item]
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{item}'")
+
+    def __setstate__(self, state):
+        # Pickled state is (None, dict of the slots that are set). Unpickled NaNs are new objects, but fields holding
+        # numpy's NaN itself are treated as unset, so they are swapped back.
+        for key, value in state[1].items():
+            if isinstance(value, float) and value != value:
+                value = np.nan
+            setattr(self, key, value)
 
-debug = False
+    def set_field(self, key: str, value):
+        if key in self.fields:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def update_fields(self, dictionary: dict):
+        for key, value in dictionary.items():
+            self.set_field(key, value)
+
+    def to_dict(self):
+        """
+        Collects the attributes that have been set, known fields first. Fields holding numpy's NaN are treated as unset.
+        :return: dict
+        """
+        a_dict = {}
+        for key in self.fields:
+            value = getattr(self, key, np.nan)
+            if value is not np.nan:
+                a_dict[key] = value
+        if self.extra is not None:
+            a_dict.update(self.extra)
+        return a_dict
+
+
+def name_tokens(name):
+    """
+    Splits a name into lower-case word tokens, for use as keys in name indices.
+    :param name: The name to split; anything that is not a string gives no tokens.
+    :return: list of tokens.
+    """
+    if not isinstance(name, str):
+        return []
+    return re.findall(r"[\w'-]+", name.lower())
 
 
-def debug_print(*args):
-    if debug:
-        print(*args)
+def normalise_name(*names):
+    """
+    Joins the given name parts into a single lower-case, whitespace-collapsed key.
+    :param names: each argument is a part of the name, eg given and family.
+    :return: The normalised name.
+    """
+    tokens = []
+    for name in names:
+        tokens += name_tokens(name)
+    return " ".join(tokens)
 
 
 def sanitise_file_ext(filename: str, ext: str):
@@ -35,17 +184,41 @@ def save_params(file: str, dictionary: dict):
 def load_params(file: str):
     file = sanitise_file_ext(file, '.yaml')
 
-    debug_print(2, 'Loading parameter file from ' + str(file))
+    log.debug("Loading parameter file from %s", file)
 
     if os.path.isfile(file):
         with open(file) as f:
             p = yaml.load(f)
     else:
         p = None
-        debug_print(1, 'No parameter file found at', str(file) + ', returning None.')
+        log.debug("No parameter file found at %s, returning None.", file)
     return p
 
 
+def load_params_dir(directory: str, n_processes: int = 1):
+    """
+    Loads every YAML file in a directory, listing the directory just once.
+    :param directory: The directory to load from; it need not exist.
+    :param n_processes: Number of worker processes to parse the files in; with 1, they are parsed in this process.
+    :return: dict of the loaded files, keyed by file name without the .yaml extension.
+    """
+    if not os.path.isdir(directory):
+        return {}
+    paths = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.endswith(".yaml") and entry.is_file():
+                paths[entry.name[:-len(".yaml")]] = entry.path
+    names = sorted(paths)
+    log.debug("Loading %s parameter files from %s", len(names), directory)
+    if n_processes > 1 and len(names) > 1:
+        with ProcessPoolExecutor(max_workers=n_processes) as executor:
+            loaded = list(executor.map(load_params, map(paths.get, names)))
+    else:
+        loaded = list(map(load_params, map(paths.get, names)))
+    return dict(zip(names, loaded))
+
+
 def mkdir_check(*paths: str):
     """
     Checks if a directory exists; if not, creates it.
@@ -53,7 +226,75 @@ def mkdir_check(*paths: str):
     """
     for path in paths:
         if not os.path.isdir(path):
-            debug_print(2, f"Making directory {path}")
+            log.debug("Making directory %s", path)
             os.mkdir(path)
         else:
-            debug_print(2, f"Directory {path} already exists, doing nothing.")
+            log.debug("Directory %s already exists, doing nothing.", path)
+
+
+@contextlib.contextmanager
+def atomic_write(path: str, mode: str = "wb"):
+    """
+    Opens a temporary file alongside path to write to, and only moves it over path once the block finishes, so that an
+    interrupted run can't leave a truncated file behind.
+    :param path: Path to write to.
+    :param mode: Mode to open the temporary file in.
+    """
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, mode) as file:
+            yield file
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+
+
+class UnionFind:
+    """
+    Disjoint-set forest over hashable items, with path compression and union by size.
+    """
+
+    def __init__(self, items: list = ()):
+        self.parents = {}
+        self.sizes = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        if item not in self.parents:
+            self.parents[item] = item
+            self.sizes[item] = 1
+
+    def find(self, item):
+        self.add(item)
+        root = item
+        while self.parents[root] != root:
+            root = self.parents[root]
+        while self.parents[item] != root:
+            self.parents[item], item = root, self.parents[item]
+        return root
+
+    def union(self, item_1, item_2):
+        root_1 = self.find(item_1)
+        root_2 = self.find(item_2)
+        if root_1 == root_2:
+            return root_1
+        if self.sizes[root_1] < self.sizes[root_2]:
+            root_1, root_2 = root_2, root_1
+        self.parents[root_2] = root_1
+        self.sizes[root_1] += self.sizes.pop(root_2)
+        return root_1
+
+    def groups(self):
+        """
+        Returns the disjoint sets, each as a list in the order their items were first added.
+        :return: list of lists.
+        """
+        groups = {}
+        for item in self.parents:
+            root = self.find(item)
+            if root not in groups:
+                groups[root] = []
+            groups[root].append(item)
+        return list(groups.values())
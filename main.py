@@ -1,4 +1,5 @@
 from hwsa.event import Event
+from hwsa.room import load_inventory
 import hwsa.utils as utils
 
 # TODO: prioritise people with specified preferences, the fewer the earlier
@@ -9,32 +10,80 @@ def main(
         d: bool,
         **kwargs
 ):
-    utils.debug = d
+    levels = None
+    if kwargs["log_levels"]:
+        levels = dict(map(lambda level: level.split("=", 1), kwargs["log_levels"]))
+    utils.set_debug(d, levels=levels)
+    phase = kwargs["phase"]
+    if phase in ("report", "emails", "write"):
+        # Later phases start from the snapshot written by an earlier run, instead of reading and allocating again
+        hwsa_2023 = Event.from_snapshot(kwargs["snapshot"] or o, output=o)
+        if phase == "report":
+            hwsa_2023.show_report(plot=not kwargs["no_plots"], n_processes=kwargs["plot_processes"])
+        elif phase == "emails":
+            hwsa_2023.generate_roommate_emails(kwargs["email_template"], output_format=kwargs["email_format"])
+        else:
+            hwsa_2023.write_rooms()
+            hwsa_2023.write_attendee_table()
+            hwsa_2023.write_store(output_format=kwargs["output_format"])
+            if kwargs["yaml_tree"]:
+                hwsa_2023.write_yaml_tree()
+        if kwargs["profile"]:
+            print(f"\nTiming report written to {hwsa_2023.write_profile()}")
+        return
+
     # Motel AC Units
     room_numbers_1 = list(range(25, 31)) + list(range(33, 49)) + [12, 67, 68]
     # Motel budget AC Units
     room_numbers_2 = list(range(79, 85))
     room_numbers = room_numbers_2 + room_numbers_1
+    room_inventory = None
+    if kwargs["rooms"]:
+        room_inventory = load_inventory(kwargs["rooms"])
     hwsa_2023 = Event.from_mq_xl(
         path=p,
         output=o,
         max_per_room=kwargs["n_max"],
         n_rooms=kwargs["n_rooms"],
-        room_numbers=room_numbers
+        room_numbers=room_numbers,
+        room_inventory=room_inventory,
+        cache=not kwargs["no_cache"]
     )
     hwsa_2023.check_for_duplicates()
     print("\n\n")
-    hwsa_2023.allocate_roommates(email_template_path=kwargs["email_template"])
-    print("\n\n")
-    hwsa_2023.show_affiliations()
-    print("\n\n")
-    hwsa_2023.show_stages()
-    print("\n\n")
-    hwsa_2023.show_diets()
-    print("\n\n")
-    hwsa_2023.show_accessibility()
-    print("\n\n")
-    hwsa_2023.show_genders()
+    if kwargs["incremental"]:
+        hwsa_2023.allocate_incremental(
+            email_template_path=kwargs["email_template"],
+            output_format=kwargs["output_format"],
+            yaml_tree=kwargs["yaml_tree"],
+            email_format=kwargs["email_format"]
+        )
+    else:
+        hwsa_2023.allocate_roommates(
+            email_template_path=kwargs["email_template"],
+            method=kwargs["allocation"],
+            output_format=kwargs["output_format"],
+            yaml_tree=kwargs["yaml_tree"],
+            email_format=kwargs["email_format"],
+            multistart_kwargs={
+                "n_starts": kwargs["starts"],
+                "seed": kwargs["seed"],
+                "time_budget": kwargs["time_budget"],
+                "n_processes": kwargs["allocation_processes"]
+            },
+            improve_kwargs={
+                "max_iterations": kwargs["improve_iterations"],
+                "time_budget": kwargs["improve_time"],
+                "seed": kwargs["seed"],
+                "temperature": kwargs["temperature"]
+            } if kwargs["improve"] else None
+        )
+    print(f"\nEvent snapshot written to {hwsa_2023.write_snapshot(path=kwargs['snapshot'])}")
+    if phase == "all":
+        print("\n\n")
+        hwsa_2023.show_report(plot=not kwargs["no_plots"], n_processes=kwargs["plot_processes"])
+    if kwargs["profile"]:
+        print(f"\nTiming report written to {hwsa_2023.write_profile()}")
 
 
 if __name__ == '__main__':
@@ -43,6 +92,21 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description="Assigns rooms for attendees."
     )
+    parser.add_argument(
+        "phase",
+        nargs="?",
+        choices=["all", "allocate", "report", "emails", "write"],
+        default="all",
+        help="Phase to run. 'all' reads the registrations, allocates rooms and reports; 'allocate' stops before the "
+             "report. Either writes a snapshot of the event, which 'report' (the breakdowns and charts), 'emails' (the "
+             "roommate emails) and 'write' (the rooms, attendee table and store) start from instead of reading and "
+             "allocating again."
+    )
+    parser.add_argument(
+        "--snapshot",
+        default=None,
+        help="Path of the event snapshot to write or restore; defaults to event.snapshot in the output directory."
+    )
     parser.add_argument(
         "-p",
         type=str,
@@ -67,6 +131,117 @@ if __name__ == '__main__':
         default=40,
         help="Number of rooms"
     )
+    parser.add_argument(
+        "--rooms",
+        type=str,
+        default=None,
+        help="Room inventory (CSV or YAML) giving each room's id and, optionally, its capacity, type, whether it is "
+             "accessible and its cost. Replaces the built-in room numbers and --n_rooms; --n_max becomes the capacity "
+             "of rooms that don't give one."
+    )
+
+    parser.add_argument(
+        "--allocation",
+        choices=["greedy", "optimal", "multistart"],
+        default="greedy",
+        help="Roommate allocation method: the greedy nominee/gender/preference passes; a global optimisation "
+             "(requires scipy); or the best-scoring of many runs of the greedy passes with attendees shuffled."
+    )
+
+    parser.add_argument(
+        "--starts",
+        type=int,
+        default=32,
+        help="Maximum number of shuffled runs for --allocation multistart."
+    )
+
+    parser.add_argument(
+        "--time_budget",
+        type=float,
+        default=None,
+        help="Seconds after which --allocation multistart begins no more runs."
+    )
+
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed for --allocation multistart and --improve; the same seed and --starts always give the same "
+             "allocation."
+    )
+
+    parser.add_argument(
+        "--improve",
+        action="store_true",
+        help="After allocating, improve the allocation by moving and swapping people between rooms."
+    )
+
+    parser.add_argument(
+        "--improve_iterations",
+        type=int,
+        default=100000,
+        help="Number of moves for --improve to try."
+    )
+
+    parser.add_argument(
+        "--improve_time",
+        type=float,
+        default=None,
+        help="Seconds after which --improve stops, if it hasn't tried all its moves."
+    )
+
+    parser.add_argument(
+        "--temperature",
+        type=float,
+        default=0.,
+        help="Starting temperature for --improve to anneal from; with 0, it only keeps moves that improve the "
+             "allocation."
+    )
+
+    parser.add_argument(
+        "--allocation_processes",
+        type=int,
+        default=1,
+        help="Number of worker processes for --allocation multistart."
+    )
+
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="Re-parse the XLSX even if it is unchanged since the last run."
+    )
+
+    parser.add_argument(
+        "--output_format",
+        choices=["jsonl", "sqlite"],
+        default="jsonl",
+        help="Format of the single file that all rooms and attendees are written to."
+    )
+
+    parser.add_argument(
+        "--yaml_tree",
+        action="store_true",
+        help="Also write a YAML file for every room and attendee."
+    )
+
+    parser.add_argument(
+        "--no_plots",
+        action="store_true",
+        help="Don't draw the breakdown charts; the printout and YAML files are still produced."
+    )
+
+    parser.add_argument(
+        "--plot_processes",
+        type=int,
+        default=1,
+        help="Number of worker processes to draw the breakdown charts in."
+    )
+
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Write the wall time of each phase, and counts of the work done, to profile.json in the output directory."
+    )
 
     parser.add_argument(
         "-d",
@@ -74,16 +249,40 @@ if __name__ == '__main__':
         help="Debug mode"
     )
 
+    parser.add_argument(
+        "--log_levels",
+        nargs="*",
+        default=None,
+        help="Logging levels for individual subsystems, overriding -d; eg --log_levels room=WARNING event=DEBUG. The "
+             "subsystems are allocation, batch, event, ingest, room and utils."
+    )
+
     parser.add_argument(
         "--email_template",
         default=None,
         help="Path to email template. To not generate emails, leave empty."
     )
-    
+
+    parser.add_argument(
+        "--email_format",
+        choices=["files", "jsonl", "mbox"],
+        default="files",
+        help="Write the roommate emails as a file per attendee, or all together in one JSON-lines or mbox file."
+    )
+
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Re-allocate against the previous run's outputs in the output directory, keeping everyone whose "
+             "registration is unchanged in their room and only rewriting the files that change. Uses greedy placement."
+    )
+
     # parser.add_argument(
     #
     # )
 
     args = parser.parse_args()
+    if args.phase == "emails" and args.email_template is None:
+        parser.error("the emails phase requires --email_template")
 
     main(**args.__dict__)